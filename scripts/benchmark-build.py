@@ -1,27 +1,62 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
+import atexit
+import itertools
 import json
 import os
 import platform
 import shutil
 import subprocess
 import sys
+import tempfile
 import time
-from datetime import datetime, timezone
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def run_cmd(cmd, cwd=None):
-    start = time.perf_counter()
-    proc = subprocess.run(
-        cmd,
-        cwd=cwd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-    )
-    elapsed = time.perf_counter() - start
-    return elapsed, proc.returncode, proc.stdout
+LOG_TAIL_BYTES = 8192
+NOISE_MARGIN = 0.02
+
+_BIN_PATH_CACHE = {}
+_TICKS = itertools.count(1)
+
+
+async def run_cmd(cmd, cwd=None, capture=True):
+    """Run cmd; returns (elapsed, returncode, output tail on failure)."""
+    if not capture:
+        start = time.perf_counter()
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=cwd,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        await proc.wait()
+        return time.perf_counter() - start, proc.returncode, ""
+
+    # Build logs can run to megabytes even with --quiet; spool them to disk and
+    # only read back the tail when the command fails.
+    with tempfile.TemporaryFile() as log:
+        start = time.perf_counter()
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=cwd,
+            stdout=log,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        await proc.wait()
+        elapsed = time.perf_counter() - start
+        output = ""
+        if proc.returncode != 0:
+            log.seek(max(0, log.seek(0, os.SEEK_END) - LOG_TAIL_BYTES))
+            output = log.read().decode(errors="replace")
+    return elapsed, proc.returncode, output
 
 
 def sysctl_int(name):
@@ -32,17 +67,84 @@ def sysctl_int(name):
         return None
 
 
-def clean_bench_path(bench_path, build_dir_name):
+def sysctl_ints(names):
+    """Query several sysctl values with one `sysctl -n` spawn; returns name -> int or None."""
+    try:
+        proc = subprocess.run(
+            ["sysctl", "-n", *names],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        lines = proc.stdout.splitlines()
+    except Exception:
+        return {name: None for name in names}
+    # An unknown name (e.g. hw.perflevel1.* on Intel) is skipped in the output,
+    # so the lines can no longer be matched up by position.
+    if proc.returncode != 0 or len(lines) != len(names):
+        return {name: sysctl_int(name) for name in names}
+    values = {}
+    for name, line in zip(names, lines):
+        try:
+            values[name] = int(line.strip())
+        except ValueError:
+            values[name] = None
+    return values
+
+
+def read_hardware():
+    """Return (physical, logical, perf, efficiency, mem_bytes) for this host."""
+    if platform.system() == "Darwin":
+        hw = sysctl_ints(
+            [
+                "hw.physicalcpu",
+                "hw.logicalcpu",
+                "hw.perflevel0.physicalcpu",
+                "hw.perflevel1.physicalcpu",
+                "hw.memsize",
+            ]
+        )
+        physical = hw["hw.physicalcpu"] or 1
+        logical = hw["hw.logicalcpu"] or physical
+        perf = hw["hw.perflevel0.physicalcpu"] or physical
+        eff = hw["hw.perflevel1.physicalcpu"] or 0
+        mem_bytes = hw["hw.memsize"] or 0
+        return physical, logical, perf, eff, mem_bytes
+
+    # The hw.* keys are Darwin-only; elsewhere read what the interpreter knows
+    # instead of spawning sysctl just to get nothing back.
+    physical = os.cpu_count() or 1
+    if hasattr(os, "sched_getaffinity"):
+        logical = len(os.sched_getaffinity(0)) or physical
+    else:
+        logical = physical
+    try:
+        mem_bytes = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, OSError, ValueError):
+        mem_bytes = 0
+    return physical, logical, physical, 0, mem_bytes
+
+
+async def clean_bench_path(bench_path, build_dir_name):
     bench_path.mkdir(parents=True, exist_ok=True)
-    build_dir = bench_path / build_dir_name
-    if build_dir.exists():
-        shutil.rmtree(build_dir, ignore_errors=True)
-    build_db = bench_path / "build.db"
-    if build_db.exists():
-        build_db.unlink()
+    # Deleting a populated scratch tree takes seconds; do it off the event loop
+    # so other probes keep building meanwhile. Both calls tolerate a missing
+    # target, so there is no need to stat first.
+    await asyncio.to_thread(shutil.rmtree, bench_path / build_dir_name, ignore_errors=True)
+    (bench_path / "build.db").unlink(missing_ok=True)
 
 
-def build_command(app_name, config, jobs, sandbox, index_store, build_system, bench_path):
+def build_command(
+    app_name,
+    config,
+    jobs,
+    sandbox,
+    index_store,
+    build_system,
+    bench_path,
+    integrated_driver=False,
+    driver_jobs=None,
+):
     cmd = [
         "swift",
         "build",
@@ -62,10 +164,15 @@ def build_command(app_name, config, jobs, sandbox, index_store, build_system, be
         cmd.append("--disable-index-store")
     if build_system and build_system != "native":
         cmd += ["--build-system", build_system]
+    if integrated_driver:
+        cmd.append("--use-integrated-swift-driver")
+    if driver_jobs:
+        # Caps the frontend jobs each swiftc driver spawns, on top of --jobs.
+        cmd += ["-Xswiftc", f"-j{driver_jobs}"]
     return cmd
 
 
-def show_bin_path(config, build_system, bench_path):
+async def show_bin_path(config, build_system, bench_path):
     cmd = [
         "swift",
         "build",
@@ -77,13 +184,71 @@ def show_bin_path(config, build_system, bench_path):
     ]
     if build_system and build_system != "native":
         cmd += ["--build-system", build_system]
-    elapsed, code, output = run_cmd(cmd)
-    if code != 0:
+    # run_cmd only keeps output for failures; the bin path is the success output.
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    stdout, _ = await proc.communicate()
+    if proc.returncode != 0:
         return None
-    return output.strip()
-
-
-def evaluate_build(
+    return stdout.decode().strip()
+
+
+async def resolve_bin_path(config, build_system, bench_path, build_dir_name):
+    if platform.system() == "Darwin" and (not build_system or build_system == "native"):
+        # The native build system lays products out as <scratch>/<triple>/<config>;
+        # build_dir_name is the Darwin triple, so elsewhere ask SwiftPM once instead.
+        return str(bench_path / build_dir_name / config)
+    key = (config, build_system, str(bench_path))
+    if key not in _BIN_PATH_CACHE:
+        bin_path = await show_bin_path(config, build_system, bench_path)
+        if not bin_path:
+            return None
+        _BIN_PATH_CACHE[key] = bin_path
+    return _BIN_PATH_CACHE[key]
+
+
+async def prime(cmd, bench_path, build_dir_name):
+    await clean_bench_path(bench_path, build_dir_name)
+    return await run_cmd(cmd)
+
+
+def dirty(path, original):
+    """Rewrite path as original plus a fresh comment line.
+
+    A bare mtime bump can be recognized as a no-op by content-hashing build
+    systems, which would time a cache hit instead of a recompile. The tick is
+    unique per call, so a rebuild never sees the content it last compiled.
+    Callers must hold SourceGate.exclusive(): no other build may be running.
+    """
+    path.write_bytes(original + f"\n// benchmark tick {next(_TICKS)}\n".encode())
+
+
+async def measure_rebuild(cmd, touch_file, touch_original, executable, iterations):
+    """Time `iterations` rebuilds; returns (avg, min, error)."""
+    rebuild_avg = 0.0
+    rebuild_min = None
+    for n in range(1, iterations + 1):
+        dirty(touch_file, touch_original)
+        # Successful rebuild output is never read, so discard it; only a
+        # failing rebuild is re-run with capture to report its log.
+        rebuild_s, code, _ = await run_cmd(cmd, capture=False)
+        if code != 0:
+            # The re-run may pass (flaky) or print nothing; the error must not be empty.
+            _, _, output = await run_cmd(cmd)
+            return None, None, output.strip() or f"rebuild failed (exit {code})"
+        try:
+            os.stat(executable)
+        except FileNotFoundError:
+            return None, None, f"Executable missing after rebuild: {executable}"
+        rebuild_avg += (rebuild_s - rebuild_avg) / n
+        rebuild_min = rebuild_s if rebuild_min is None else min(rebuild_min, rebuild_s)
+    return rebuild_avg, rebuild_min, None
+
+
+async def evaluate_build(
     label,
     app_name,
     config,
@@ -94,27 +259,50 @@ def evaluate_build(
     bench_path,
     build_dir_name,
     touch_file,
+    touch_original,
     iterations,
+    sources,
+    primed=False,
+    integrated_driver=False,
+    driver_jobs=None,
 ):
-    clean_bench_path(bench_path, build_dir_name)
-    cmd = build_command(app_name, config, jobs, sandbox, index_store, build_system, bench_path)
+    cmd = build_command(
+        app_name,
+        config,
+        jobs,
+        sandbox,
+        index_store,
+        build_system,
+        bench_path,
+        integrated_driver=integrated_driver,
+        driver_jobs=driver_jobs,
+    )
 
-    clean_s, code, output = run_cmd(cmd)
+    # A primed scratch path already holds a build for this (jobs, build_system)
+    # group; an unmeasured warm-up brings it up to date with this variant's flags.
+    clean_s = None
+    async with sources.shared():
+        if primed:
+            _, code, output = await run_cmd(cmd)
+        else:
+            clean_s, code, output = await prime(cmd, bench_path, build_dir_name)
     result = {
         "label": label,
         "jobs": jobs,
         "sandbox": sandbox,
         "index_store": index_store,
         "build_system": build_system,
-        "clean_s": round(clean_s, 3),
+        "integrated_driver": integrated_driver,
+        "driver_jobs": driver_jobs,
+        "clean_s": clean_s,
         "rebuild_s_avg": None,
         "rebuild_s_min": None,
     }
     if code != 0:
-        result["error"] = output.strip()
+        result["error"] = output.strip() or f"build failed (exit {code})"
         return result
 
-    bin_path = show_bin_path(config, build_system, bench_path)
+    bin_path = await resolve_bin_path(config, build_system, bench_path, build_dir_name)
     if not bin_path:
         result["error"] = "Failed to resolve bin path"
         return result
@@ -123,37 +311,171 @@ def evaluate_build(
         result["error"] = f"Executable missing after clean build: {executable}"
         return result
 
-    rebuild_times = []
-    for _ in range(iterations):
-        touch_file.touch()
-        rebuild_s, code, output = run_cmd(cmd)
-        if code != 0:
-            result["error"] = output.strip()
-            return result
-        if not executable.exists():
-            result["error"] = f"Executable missing after rebuild: {executable}"
-            return result
-        rebuild_times.append(rebuild_s)
-
-    rebuild_avg = sum(rebuild_times) / len(rebuild_times)
-    result["rebuild_s_avg"] = round(rebuild_avg, 3)
-    result["rebuild_s_min"] = round(min(rebuild_times), 3)
+    # Timed rebuilds rewrite touch_file and must not share the machine, so
+    # they run with no other build in flight.
+    async with sources.exclusive():
+        rebuild_avg, rebuild_min, error = await measure_rebuild(
+            cmd, touch_file, touch_original, executable, iterations
+        )
+    if error is not None:
+        result["error"] = error
+        return result
+
+    result["rebuild_s_avg"] = rebuild_avg
+    result["rebuild_s_min"] = rebuild_min
     return result
 
 
-def is_faster(candidate, reference):
+class CoreBudget:
+    """Counting semaphore over CPU cores; each probe holds as many as its --jobs."""
+
+    def __init__(self, cores):
+        self.cores = max(1, cores)
+        self.free = self.cores
+        self._cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def hold(self, jobs):
+        # A probe wider than the machine still runs, just alone.
+        need = min(jobs, self.cores)
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.free >= need)
+            self.free -= need
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.free += need
+                self._cond.notify_all()
+
+
+class SourceGate:
+    """Reader/writer gate over the shared source tree.
+
+    Builds only read the sources and may overlap (shared); dirtying them for
+    timed rebuilds needs the tree and the machine to itself (exclusive).
+    Waiting exclusive holders block new shared ones so they are not starved.
+    """
+
+    def __init__(self):
+        self.readers = 0
+        self.writing = False
+        self.waiting = 0
+        self._cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def shared(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self.writing and not self.waiting)
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.readers -= 1
+                self._cond.notify_all()
+
+    @asynccontextmanager
+    async def exclusive(self):
+        async with self._cond:
+            self.waiting += 1
+            try:
+                await self._cond.wait_for(lambda: not self.writing and not self.readers)
+            finally:
+                self.waiting -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.writing = False
+                self._cond.notify_all()
+
+
+def probe_key(jobs, sandbox, index_store, build_system, integrated_driver=False, driver_jobs=None):
+    return (
+        int(jobs),
+        sandbox,
+        index_store,
+        build_system or "native",
+        bool(integrated_driver),
+        driver_jobs or None,
+    )
+
+
+def is_faster(candidate, reference, margin=NOISE_MARGIN):
+    # The fastest rebuild is a steadier estimate than the mean (one slow run at
+    # the default --iterations 1 skews it), and near-ties within the margin keep
+    # the reference so saved configs don't flip between runs on noise.
     if not candidate or candidate.get("error") or reference.get("error"):
         return False
-    return candidate["rebuild_s_avg"] < reference["rebuild_s_avg"]
+    return candidate["rebuild_s_min"] < reference["rebuild_s_min"] * (1 - margin)
 
 
-def main():
+def load_recent_report(path, config, hardware, max_age_hours):
+    """Return the report at path if it was taken for this config and hardware within max_age_hours."""
+    try:
+        report = json.loads(path.read_text())
+        taken = datetime.strptime(report["timestamp"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    except (OSError, ValueError, KeyError):
+        return None
+    if report.get("config") != config or report.get("hardware") != hardware:
+        return None
+    if datetime.now(timezone.utc) - taken > timedelta(hours=max_age_hours):
+        return None
+    return report
+
+
+def print_best(best):
+    print("Best options:")
+    print(
+        f"  jobs={best['jobs']}, sandbox={best['sandbox']}, "
+        f"index_store={best['index_store']}, build_system={best['build_system']}, "
+        f"integrated_driver={best.get('integrated_driver', False)}, "
+        f"driver_jobs={best.get('driver_jobs')}"
+    )
+
+
+def write_build_conf(best, timestamp, hardware):
+    config_dir = Path.home() / ".config" / "ollamabot"
+    config_dir.mkdir(parents=True, exist_ok=True)
+    config_path = config_dir / "build.conf"
+    body = (
+        "# Autogenerated by scripts/benchmark-build.py\n"
+        f'BUILD_JOBS={best["jobs"]}\n'
+        f'BUILD_DISABLE_SANDBOX={"1" if best["sandbox"] == "off" else "0"}\n'
+        f'BUILD_DISABLE_INDEX_STORE={"1" if best["index_store"] == "disable" else "0"}\n'
+        f'BUILD_SYSTEM="{best["build_system"]}"\n'
+        f'BUILD_INTEGRATED_DRIVER={"1" if best.get("integrated_driver") else "0"}\n'
+        f'BUILD_DRIVER_JOBS="{best.get("driver_jobs") or ""}"\n'
+        f'BUILD_BENCHMARK_AT="{timestamp}"\n'
+        f'BUILD_BENCHMARK_MACHINE="{hardware["machine"]}"\n'
+        f'BUILD_BENCHMARK_CPU_PHYSICAL={hardware["physical_cores"]}\n'
+        f'BUILD_BENCHMARK_CPU_PERF={hardware["perf_cores"]}\n'
+        f'BUILD_BENCHMARK_CPU_EFFICIENCY={hardware["efficiency_cores"]}\n'
+    )
+    # build-app.sh sources this file; swap it in whole so a crash mid-write
+    # never leaves it half-written.
+    tmp_path = config_path.with_name(config_path.name + ".tmp")
+    tmp_path.write_text(body)
+    os.replace(tmp_path, config_path)
+    return config_path
+
+
+async def main():
     parser = argparse.ArgumentParser(description="Benchmark SwiftPM build options for OllamaBot.")
     parser.add_argument("--config", choices=["debug", "release"], default="debug")
     parser.add_argument("--iterations", type=int, default=1)
     parser.add_argument("--touch", default="")
     parser.add_argument("--bench-path", default="")
     parser.add_argument("--save", action="store_true")
+    parser.add_argument(
+        "--max-age-hours",
+        type=float,
+        default=168,
+        help="Reuse the latest report if it matches this machine and is at most this old",
+    )
+    parser.add_argument("--force", action="store_true", help="Always re-run the benchmark")
     args = parser.parse_args()
 
     script_dir = Path(__file__).resolve().parent
@@ -163,24 +485,43 @@ def main():
     bench_path = Path(args.bench_path) if args.bench_path else project_dir / ".build-bench"
     results_dir = project_dir / "benchmark_results"
     results_dir.mkdir(parents=True, exist_ok=True)
+    latest_path = results_dir / "build-benchmark-latest.json"
+
+    machine = platform.machine()
+    build_dir_name = f"{machine}-apple-macosx"
+
+    physical, logical, perf, eff, mem_bytes = read_hardware()
+    hardware = {
+        "machine": machine,
+        "physical_cores": physical,
+        "logical_cores": logical,
+        "perf_cores": perf,
+        "efficiency_cores": eff,
+        "mem_bytes": mem_bytes,
+    }
+
+    # Neither the hardware nor Package.swift changes often; a recent report for
+    # the same machine and config is as good as re-running every probe.
+    if not args.force:
+        cached = load_recent_report(latest_path, args.config, hardware, args.max_age_hours)
+        if cached:
+            print(f"Using benchmark from {cached['timestamp']} ({latest_path}); pass --force to re-run.")
+            print_best(cached["best"])
+            if args.save:
+                config_path = write_build_conf(cached["best"], cached["timestamp"], hardware)
+                print(f"\nSaved build config: {config_path}")
+            return
 
     touch_file = Path(args.touch) if args.touch else project_dir / "Sources" / "OllamaBotApp.swift"
     if not touch_file.exists():
         sources_dir = project_dir / "Sources"
-        swift_files = list(sources_dir.rglob("*.swift"))
-        if not swift_files:
+        touch_file = next(sources_dir.rglob("*.swift"), None)
+        if touch_file is None:
             print("No Swift files found to touch for rebuild benchmark.", file=sys.stderr)
             sys.exit(1)
-        touch_file = swift_files[0]
-
-    machine = platform.machine()
-    build_dir_name = f"{machine}-apple-macosx"
-
-    physical = sysctl_int("hw.physicalcpu") or 1
-    logical = sysctl_int("hw.logicalcpu") or physical
-    perf = sysctl_int("hw.perflevel0.physicalcpu") or physical
-    eff = sysctl_int("hw.perflevel1.physicalcpu") or 0
-    mem_bytes = sysctl_int("hw.memsize") or 0
+    # Rebuilds rewrite the touch file; put the original back however we exit.
+    touch_original = touch_file.read_bytes()
+    atexit.register(touch_file.write_bytes, touch_original)
 
     candidates = [perf, physical]
     if logical > physical:
@@ -201,41 +542,83 @@ def main():
     print(f"  Bench path: {bench_path}")
     print("")
 
-    results = []
+    base_jobs = perf
+    # Probes that share (jobs, build_system) share a scratch path: the first one
+    # pays for the clean build and the rest only measure rebuilds on top of it.
+    # Probes run concurrently as long as their combined --jobs fits the logical
+    # core count, so several narrow configs can share a wide machine. Only their
+    # clean/warm-up builds overlap; timed rebuilds run one at a time (SourceGate).
+    cores = CoreBudget(logical)
+    sources = SourceGate()
+    scratch = {}
+
+    probes = []
     cache = {}
 
-    def get_result(label, jobs, sandbox, index_store, build_system, allow_failure=False):
-        key = (jobs, sandbox, index_store, build_system)
-        if key in cache:
-            return cache[key]
-        res = evaluate_build(
-            label=label,
-            app_name=app_name,
-            config=args.config,
-            jobs=jobs,
-            sandbox=sandbox,
-            index_store=index_store,
-            build_system=build_system,
-            bench_path=bench_path,
-            build_dir_name=build_dir_name,
-            touch_file=touch_file,
-            iterations=args.iterations,
+    async def probe(label, jobs, sandbox, index_store, build_system, integrated_driver, driver_jobs):
+        group = scratch.setdefault(
+            (jobs, build_system),
+            {
+                "path": bench_path / f"jobs{jobs}-{build_system}",
+                "lock": asyncio.Lock(),
+                "primed": False,
+            },
         )
-        cache[key] = res
-        results.append(res)
+        async with group["lock"], cores.hold(jobs):
+            res = await evaluate_build(
+                label=label,
+                app_name=app_name,
+                config=args.config,
+                jobs=jobs,
+                sandbox=sandbox,
+                index_store=index_store,
+                build_system=build_system,
+                bench_path=group["path"],
+                build_dir_name=build_dir_name,
+                touch_file=touch_file,
+                touch_original=touch_original,
+                iterations=args.iterations,
+                sources=sources,
+                primed=group["primed"],
+                integrated_driver=integrated_driver,
+                driver_jobs=driver_jobs,
+            )
+            group["primed"] = group["primed"] or not res.get("error")
+            return res
+
+    async def get_result(
+        label,
+        jobs,
+        sandbox,
+        index_store,
+        build_system,
+        integrated_driver=False,
+        driver_jobs=None,
+        allow_failure=False,
+    ):
+        key = probe_key(jobs, sandbox, index_store, build_system, integrated_driver, driver_jobs)
+        if key not in cache:
+            cache[key] = asyncio.ensure_future(
+                probe(label, jobs, sandbox, index_store, build_system, integrated_driver, driver_jobs)
+            )
+            probes.append(cache[key])
+        res = await cache[key]
         if res.get("error") and not allow_failure:
             print(f"Build failed for {label}. Output:\n{res['error']}", file=sys.stderr)
             sys.exit(1)
         return res
 
-    base_jobs = perf
-    baseline = get_result("baseline", base_jobs, "on", "auto", "native")
-
-    sandbox_off = get_result("sandbox_off", base_jobs, "off", "auto", "native")
+    # baseline and sandbox_off are independent of each other (they share a
+    # scratch group, so one primes it); the rest of the greedy chain depends on
+    # the choices made before it.
+    baseline, sandbox_off = await asyncio.gather(
+        get_result("baseline", base_jobs, "on", "auto", "native"),
+        get_result("sandbox_off", base_jobs, "off", "auto", "native"),
+    )
     sandbox_choice = "off" if is_faster(sandbox_off, baseline) else "on"
     sandbox_ref = sandbox_off if sandbox_choice == "off" else baseline
 
-    build_next = get_result(
+    build_next = await get_result(
         "build_system_next",
         base_jobs,
         sandbox_choice,
@@ -246,7 +629,7 @@ def main():
     build_system_choice = "next" if is_faster(build_next, sandbox_ref) else "native"
     build_ref = build_next if build_system_choice == "next" else sandbox_ref
 
-    index_disable = get_result(
+    index_disable = await get_result(
         "index_store_disable",
         base_jobs,
         sandbox_choice,
@@ -256,51 +639,123 @@ def main():
     index_choice = "disable" if is_faster(index_disable, build_ref) else "auto"
     index_ref = index_disable if index_choice == "disable" else build_ref
 
-    job_results = []
-    for jobs in candidates:
-        res = get_result(
-            f"jobs_{jobs}",
-            jobs,
-            sandbox_choice,
-            index_choice,
-            build_system_choice,
-        )
-        if not res.get("error"):
-            job_results.append(res)
+    integrated = await get_result(
+        "integrated_driver",
+        base_jobs,
+        sandbox_choice,
+        index_choice,
+        build_system_choice,
+        integrated_driver=True,
+        allow_failure=True,
+    )
+    integrated_choice = is_faster(integrated, index_ref)
+    integrated_ref = integrated if integrated_choice else index_ref
+
+    # Each of the --jobs llbuild tasks may start its own swiftc frontends; cap
+    # those so jobs x frontend jobs roughly fills the machine instead of
+    # multiplying past it.
+    frontend_jobs = max(1, logical // base_jobs)
+    driver_capped = await get_result(
+        f"driver_jobs_{frontend_jobs}",
+        base_jobs,
+        sandbox_choice,
+        index_choice,
+        build_system_choice,
+        integrated_driver=integrated_choice,
+        driver_jobs=frontend_jobs,
+        allow_failure=True,
+    )
+    driver_jobs_choice = frontend_jobs if is_faster(driver_capped, integrated_ref) else None
+    driver_ref = driver_capped if driver_jobs_choice else integrated_ref
+
+    # Walk the sweep against the cache so points already measured by the greedy
+    # chain (jobs == base_jobs) reuse that result instead of another rebuild.
+    sweep = {}
+
+    async def sweep_points(points):
+        pending = []
+        for jobs in points:
+            key = probe_key(
+                jobs,
+                sandbox_choice,
+                index_choice,
+                build_system_choice,
+                integrated_choice,
+                driver_jobs_choice,
+            )
+            if key in cache:
+                pending.append(cache[key])
+            else:
+                pending.append(
+                    get_result(
+                        f"jobs_{jobs}",
+                        jobs,
+                        sandbox_choice,
+                        index_choice,
+                        build_system_choice,
+                        integrated_driver=integrated_choice,
+                        driver_jobs=driver_jobs_choice,
+                    )
+                )
+        for jobs, res in zip(points, await asyncio.gather(*pending)):
+            sweep[jobs] = res
+        return [sweep[jobs] for jobs in points]
+
+    def sweep_time(res):
+        return float("inf") if res.get("error") else res["rebuild_s_min"]
+
+    # Rebuild time is close to unimodal in --jobs (faster until the cores
+    # saturate, then flat or slower from contention), so narrow the sorted
+    # candidates with a ternary search instead of building every one.
+    lo, hi = 0, len(candidates) - 1
+    while hi - lo > 2:
+        m1 = lo + (hi - lo) // 3
+        m2 = hi - (hi - lo) // 3
+        r1, r2 = await sweep_points([candidates[m1], candidates[m2]])
+        if sweep_time(r1) < sweep_time(r2):
+            hi = m2
+        else:
+            lo = m1
+    await sweep_points(candidates[lo:hi + 1])
+
+    job_results = [res for res in [driver_ref, *sweep.values()] if not res.get("error")]
+    results = [task.result() for task in probes]
 
     best_jobs = base_jobs
-    best_job_result = index_ref
+    best_job_result = driver_ref
     if job_results:
-        best_job_result = min(job_results, key=lambda r: r["rebuild_s_avg"])
+        best_job_result = min(job_results, key=lambda r: r["rebuild_s_min"])
         best_jobs = best_job_result["jobs"]
 
-    print("Results:")
+    lines = ["Results:"]
     for res in results:
         if res.get("error"):
-            print(f"  {res['label']}: ERROR")
+            lines.append(f"  {res['label']}: ERROR")
         else:
-            print(
-                f"  {res['label']}: clean={res['clean_s']}s "
-                f"rebuild={res['rebuild_s_avg']}s "
+            clean = f"{res['clean_s']:.3f}s" if res["clean_s"] is not None else "shared"
+            lines.append(
+                f"  {res['label']}: clean={clean} "
+                f"rebuild={res['rebuild_s_avg']:.3f}s min={res['rebuild_s_min']:.3f}s "
                 f"(jobs={res['jobs']}, sandbox={res['sandbox']}, "
-                f"index={res['index_store']}, build={res['build_system']})"
+                f"index={res['index_store']}, build={res['build_system']}, "
+                f"integrated_driver={res['integrated_driver']}, driver_jobs={res['driver_jobs']})"
             )
-    print("")
+    sys.stdout.write("\n".join(lines) + "\n\n")
 
     best = {
         "jobs": best_jobs,
         "sandbox": sandbox_choice,
         "index_store": index_choice,
         "build_system": build_system_choice,
+        "integrated_driver": integrated_choice,
+        "driver_jobs": driver_jobs_choice,
         "rebuild_s_avg": best_job_result.get("rebuild_s_avg"),
+        "rebuild_s_min": best_job_result.get("rebuild_s_min"),
     }
-    print("Best options:")
-    print(
-        f"  jobs={best['jobs']}, sandbox={best['sandbox']}, "
-        f"index_store={best['index_store']}, build_system={best['build_system']}"
-    )
+    print_best(best)
 
-    timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    now = datetime.now(timezone.utc)
+    timestamp = now.strftime("%Y-%m-%dT%H:%M:%SZ")
     report = {
         "timestamp": timestamp,
         "config": args.config,
@@ -308,44 +763,30 @@ def main():
         "project_dir": str(project_dir),
         "bench_path": str(bench_path),
         "touch_file": str(touch_file),
-        "hardware": {
-            "machine": machine,
-            "physical_cores": physical,
-            "logical_cores": logical,
-            "perf_cores": perf,
-            "efficiency_cores": eff,
-            "mem_bytes": mem_bytes,
-        },
+        "hardware": hardware,
         "jobs_candidates": candidates,
         "tests": results,
         "best": best,
     }
 
-    report_path = results_dir / f"build-benchmark-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.json"
-    with report_path.open("w") as f:
-        json.dump(report, f, indent=2)
-    latest_path = results_dir / "build-benchmark-latest.json"
-    shutil.copyfile(report_path, latest_path)
+    report_path = results_dir / f"build-benchmark-{now.strftime('%Y%m%d-%H%M%S')}.json"
+    if orjson is not None:
+        report_path.write_bytes(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+    else:
+        with report_path.open("w") as f:
+            json.dump(report, f, indent=2)
+    latest_path.unlink(missing_ok=True)
+    try:
+        os.link(report_path, latest_path)
+    except OSError:
+        shutil.copyfile(report_path, latest_path)
 
     if args.save:
-        config_dir = Path.home() / ".config" / "ollamabot"
-        config_dir.mkdir(parents=True, exist_ok=True)
-        config_path = config_dir / "build.conf"
-        with config_path.open("w") as f:
-            f.write("# Autogenerated by scripts/benchmark-build.py\n")
-            f.write(f'BUILD_JOBS={best_jobs}\n')
-            f.write(f'BUILD_DISABLE_SANDBOX={"1" if sandbox_choice == "off" else "0"}\n')
-            f.write(f'BUILD_DISABLE_INDEX_STORE={"1" if index_choice == "disable" else "0"}\n')
-            f.write(f'BUILD_SYSTEM="{build_system_choice}"\n')
-            f.write(f'BUILD_BENCHMARK_AT="{timestamp}"\n')
-            f.write(f'BUILD_BENCHMARK_MACHINE="{machine}"\n')
-            f.write(f'BUILD_BENCHMARK_CPU_PHYSICAL={physical}\n')
-            f.write(f'BUILD_BENCHMARK_CPU_PERF={perf}\n')
-            f.write(f'BUILD_BENCHMARK_CPU_EFFICIENCY={eff}\n')
+        config_path = write_build_conf(best, timestamp, hardware)
         print(f"\nSaved build config: {config_path}")
 
     print(f"Saved report: {report_path}")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
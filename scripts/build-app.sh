@@ -42,6 +42,8 @@ BUILD_JOBS=""
 DISABLE_SANDBOX=""
 DISABLE_INDEX_STORE=""
 BUILD_SYSTEM=""
+INTEGRATED_DRIVER=""
+DRIVER_JOBS=""
 
 # Load saved build config (if present)
 if [ -f "$BUILD_CONFIG_FILE" ]; then
@@ -56,6 +58,12 @@ fi
 if [ -n "${BUILD_DISABLE_INDEX_STORE:-}" ] && [ -z "${DISABLE_INDEX_STORE:-}" ]; then
     DISABLE_INDEX_STORE="$BUILD_DISABLE_INDEX_STORE"
 fi
+if [ -n "${BUILD_INTEGRATED_DRIVER:-}" ] && [ -z "${INTEGRATED_DRIVER:-}" ]; then
+    INTEGRATED_DRIVER="$BUILD_INTEGRATED_DRIVER"
+fi
+if [ -n "${BUILD_DRIVER_JOBS:-}" ] && [ -z "${DRIVER_JOBS:-}" ]; then
+    DRIVER_JOBS="$BUILD_DRIVER_JOBS"
+fi
 
 # Parse arguments
 while [[ $# -gt 0 ]]; do
@@ -190,6 +198,10 @@ if [ "$DISABLE_INDEX_STORE" = "1" ]; then SWIFT_ARGS+=(--disable-index-store); f
 if [ -n "$BUILD_SYSTEM" ] && [ "$BUILD_SYSTEM" != "native" ]; then
     SWIFT_ARGS+=(--build-system "$BUILD_SYSTEM")
 fi
+if [ "${INTEGRATED_DRIVER:-}" = "1" ]; then SWIFT_ARGS+=(--use-integrated-swift-driver); fi
+if [[ "${DRIVER_JOBS:-}" =~ ^[0-9]+$ ]] && [ "$DRIVER_JOBS" -gt 0 ]; then
+    SWIFT_ARGS+=(-Xswiftc "-j${DRIVER_JOBS}")
+fi
 
 swift "${SWIFT_ARGS[@]}"
 
@@ -8,21 +8,34 @@ Policy: ACCRUE ALL IDEAS, NO REFACTOR, single-writer artifacts.
 """
 
 import argparse
+import asyncio
+import functools
 import hashlib
-import http.server
+import http.client
+import io
 import json
+import mmap
 import os
+import queue
 import re
 import signal
 import sqlite3
 import subprocess
 import sys
+import threading
 import time
+import urllib.error
 import urllib.parse
-import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
 from contextlib import contextmanager
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # ─── Constants ───────────────────────────────────────────────────────────────
 
 VERSION = "0.1.0"
@@ -30,15 +43,44 @@ DEFAULT_HOST = "127.0.0.1"
 DEFAULT_PORT = 7337
 DEFAULT_DB = ".cursor/code/code.db"
 LEASE_MS = 30000
+HEARTBEAT_INTERVAL_S = 15
 MAX_ATTEMPTS = 3
 ARTIFACT_DIR = "docs/code_runtime/artifacts/by-hash"
+HTTP_THREADS = 16
+JANITOR_INTERVAL_S = 5
+READY_WAIT_MAX_S = 30
+HTTP_TIMEOUT_S = 10
+ENQUEUE_CHUNK = 500
 VALID_PREFIXES = ("@file:", "@cmd:", "@url:", "@git:", "@gh:", "@doc:")
 
+if orjson is not None:
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+else:
+    def json_dumps(obj):
+        return json.dumps(obj).encode()
+
+    json_loads = json.loads
+
 # ─── DB Schema ───────────────────────────────────────────────────────────────
 
+# Per-connection tuning. synchronous=NORMAL is durable in WAL mode (only the
+# last commits can roll back on power loss) and drops an fsync per commit.
+# journal_mode=WAL persists in the file, so only init_db sets it.
+PRAGMAS = """
+PRAGMA busy_timeout=5000;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-20000;
+PRAGMA mmap_size=268435456;
+PRAGMA wal_autocheckpoint=1000;
+"""
+
+# Bump when SCHEMA or the migrations in init_db change.
+SCHEMA_VERSION = 2
+
 SCHEMA = """
 PRAGMA journal_mode=WAL;
-PRAGMA busy_timeout=5000;
 
 CREATE TABLE IF NOT EXISTS jobs (
     id TEXT PRIMARY KEY,
@@ -52,7 +94,8 @@ CREATE TABLE IF NOT EXISTS jobs (
     error TEXT,
     attempts INTEGER NOT NULL DEFAULT 0,
     max_attempts INTEGER NOT NULL DEFAULT 3,
-    dedupe_key TEXT
+    dedupe_key TEXT,
+    pending_deps INTEGER NOT NULL DEFAULT 0
 );
 
 CREATE TABLE IF NOT EXISTS job_deps (
@@ -63,6 +106,12 @@ CREATE TABLE IF NOT EXISTS job_deps (
     FOREIGN KEY (dep_id) REFERENCES jobs(id)
 );
 
+CREATE TABLE IF NOT EXISTS artifacts (
+    hash TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS events (
     ts REAL NOT NULL,
     job_id TEXT,
@@ -80,34 +129,178 @@ CREATE INDEX IF NOT EXISTS idx_events_job ON events(job_id);
 # ─── DB Layer ────────────────────────────────────────────────────────────────
 
 
+# IN-list slice size; bound twice in one statement, it stays under the
+# 999-variable limit of SQLite builds before 3.32.
+SQL_IN_CHUNK = 400
+
+# Count of a job's deps that exist and are not done; claimable at zero.
+PENDING_DEPS_SQL = """
+    SELECT COUNT(*) FROM job_deps d JOIN jobs dj ON dj.id = d.dep_id
+    WHERE d.job_id = jobs.id AND dj.status != 'done'
+"""
+
+
 def init_db(db_path):
+    if sqlite3.sqlite_version_info < (3, 35, 0):
+        # claim_ready relies on UPDATE ... RETURNING.
+        raise RuntimeError(
+            f"code needs SQLite >= 3.35 for UPDATE ... RETURNING; this Python links {sqlite3.sqlite_version}"
+        )
     os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
     conn = sqlite3.connect(db_path)
-    conn.executescript(SCHEMA)
-    conn.close()
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        conn.executescript(SCHEMA)
+        cols = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "pending_deps" not in cols:
+            with conn:
+                conn.execute("ALTER TABLE jobs ADD COLUMN pending_deps INTEGER NOT NULL DEFAULT 0")
+                conn.execute(f"UPDATE jobs SET pending_deps = ({PENDING_DEPS_SQL})")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, pending_deps, lane, created_at)"
+        )
+        conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+    finally:
+        conn.close()
+
+
+_tls = threading.local()
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def _connect(db_path, read_only=False):
+    if read_only:
+        uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(
+            uri, uri=True, timeout=10, isolation_level=None, cached_statements=256
+        )
+    else:
+        # Shared across handler threads, always used under its lock.
+        conn = sqlite3.connect(
+            db_path,
+            timeout=10,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+    conn.row_factory = sqlite3.Row
+    conn.executescript(PRAGMAS)
+    return conn
 
 
 @contextmanager
 def db_conn(db_path):
-    conn = sqlite3.connect(db_path, timeout=10)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    conn.execute("PRAGMA busy_timeout=5000")
-    try:
-        yield conn
-    finally:
-        conn.close()
+    """Yield this thread's read-only connection to db_path, opening it on first use.
+
+    One long-lived connection per thread is SQLite's concurrency model; in WAL
+    mode these readers never wait on the writer.
+    """
+    conns = getattr(_tls, "conns", None)
+    if conns is None:
+        conns = _tls.conns = {}
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = conns[db_path] = _connect(db_path, read_only=True)
+    yield conn
+
+
+@contextmanager
+def with_writer(db_path):
+    """Yield the process's single writer connection inside BEGIN IMMEDIATE ... COMMIT.
+
+    Writers are serialized here rather than by SQLite, so they never spin on
+    SQLITE_BUSY against each other; the write lock is taken up front.
+    """
+    with _writers_lock:
+        entry = _writers.get(db_path)
+        if entry is None:
+            entry = _writers[db_path] = (_connect(db_path), threading.Lock())
+    conn, lock = entry
+    with lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            # A failed COMMIT (busy, disk full) leaves the transaction open;
+            # roll back so the shared connection can BEGIN again.
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+
+EVENT_INSERT = "INSERT INTO events(ts, job_id, kind, msg) VALUES(?, ?, ?, ?)"
+EVENT_BATCH = 500
+EVENT_FLUSH_S = 0.1
+
+# Set while the server's event writer thread runs; events then bypass the
+# caller's transaction and are written in batches.
+_event_q = None
 
 
 def log_event(conn, job_id, kind, msg=""):
-    conn.execute(
-        "INSERT INTO events(ts, job_id, kind, msg) VALUES(?, ?, ?, ?)",
-        (time.time(), job_id, kind, msg[:500] if msg else ""),
-    )
+    log_events(conn, [(job_id, kind, msg)])
+
+
+def log_events(conn, events):
+    """log_event for many (job_id, kind, msg) tuples, sharing one timestamp."""
+    now = time.time()
+    rows = [(now, job_id, kind, msg[:500] if msg else "") for job_id, kind, msg in events]
+    if _event_q is not None:
+        for row in rows:
+            _event_q.put(row)
+    else:
+        conn.executemany(EVENT_INSERT, rows)
+
+
+def _event_writer(db_path, q):
+    stopping = False
+    while not stopping:
+        batch = [q.get()]
+        deadline = time.monotonic() + EVENT_FLUSH_S
+        while len(batch) < EVENT_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        if None in batch:
+            stopping = True
+            while not q.empty():
+                batch.append(q.get_nowait())
+            batch = [row for row in batch if row is not None]
+        if not batch:
+            continue
+        try:
+            with with_writer(db_path) as conn:
+                conn.executemany(EVENT_INSERT, batch)
+        except sqlite3.Error as e:
+            sys.stderr.write(f"[code] dropped {len(batch)} events: {e}\n")
+
+
+def start_event_writer(db_path):
+    """Route log_event through a background thread that batches inserts."""
+    global _event_q
+    _event_q = queue.SimpleQueue()
+    thread = threading.Thread(target=_event_writer, args=(db_path, _event_q), daemon=True)
+    thread.start()
+    return thread
+
+
+def stop_event_writer(thread):
+    """Flush queued events and return log_event to direct writes."""
+    global _event_q
+    q, _event_q = _event_q, None
+    q.put(None)
+    thread.join()
 
 
 def validate_payload(payload):
-    if not any(payload.startswith(p) for p in VALID_PREFIXES):
+    if not payload.startswith(VALID_PREFIXES):
         raise ValueError(
             f"Payload must start with one of {VALID_PREFIXES}. Got: {payload[:80]}"
         )
@@ -116,159 +309,202 @@ def validate_payload(payload):
 def enqueue_job(conn, job_id, lane, payload, dedupe_key=None, max_attempts=MAX_ATTEMPTS):
     validate_payload(payload)
     now = time.time()
-    conn.execute(
+    res = conn.execute(
         """INSERT OR IGNORE INTO jobs(id, lane, payload, status, created_at, updated_at, dedupe_key, max_attempts)
            VALUES(?, ?, ?, 'queued', ?, ?, ?, ?)""",
         (job_id, lane, payload, now, now, dedupe_key, max_attempts),
     )
+    if res.rowcount:
+        # Edges may name this job before it exists; they start counting now.
+        conn.execute(
+            "UPDATE jobs SET pending_deps=pending_deps+1 WHERE id IN (SELECT job_id FROM job_deps WHERE dep_id=?)",
+            (job_id,),
+        )
     log_event(conn, job_id, "enqueued", payload[:120])
 
 
-def add_dep(conn, job_id, dep_id):
-    conn.execute(
+def in_chunks(ids, size=SQL_IN_CHUNK):
+    """Yield (ids, "?,?,...") slices small enough to bind in one statement."""
+    for i in range(0, len(ids), size):
+        chunk = ids[i:i + size]
+        yield chunk, ",".join("?" * len(chunk))
+
+
+def add_deps(conn, pairs):
+    """Insert (job_id, dep_id) edges in one executemany and recount pending_deps."""
+    conn.executemany(
         "INSERT OR IGNORE INTO job_deps(job_id, dep_id) VALUES(?, ?)",
-        (job_id, dep_id),
+        pairs,
     )
+    for chunk, marks in in_chunks(list({job_id for job_id, _ in pairs})):
+        conn.execute(
+            f"UPDATE jobs SET pending_deps = ({PENDING_DEPS_SQL}) WHERE id IN ({marks})",
+            chunk,
+        )
+
+
+def release_dependents(conn, done_ids):
+    """Decrement pending_deps on every job waiting on the newly done ids."""
+    for chunk, marks in in_chunks(list(done_ids)):
+        conn.execute(
+            f"""UPDATE jobs SET pending_deps = pending_deps - (
+                    SELECT COUNT(*) FROM job_deps d WHERE d.job_id = jobs.id AND d.dep_id IN ({marks})
+                )
+                WHERE id IN (SELECT job_id FROM job_deps WHERE dep_id IN ({marks}))""",
+            [*chunk, *chunk],
+        )
 
 
 def requeue_stale(conn):
     now = time.time()
-    conn.execute("BEGIN IMMEDIATE")
-    try:
-        stale = conn.execute(
-            "SELECT id, attempts, max_attempts FROM jobs WHERE status='running' AND lease_until < ?",
-            (now,),
-        ).fetchall()
-        count = 0
-        for row in stale:
-            if row["attempts"] < row["max_attempts"]:
-                conn.execute(
-                    "UPDATE jobs SET status='queued', holder=NULL, lease_until=NULL, updated_at=? WHERE id=?",
-                    (now, row["id"]),
-                )
-                log_event(conn, row["id"], "requeued", "stale lease")
-            else:
-                conn.execute(
-                    "UPDATE jobs SET status='failed', error='max attempts exceeded', updated_at=? WHERE id=?",
-                    (now, row["id"]),
-                )
-                log_event(conn, row["id"], "failed", "max attempts exceeded")
-            count += 1
-        conn.execute("COMMIT")
-    except Exception:
-        conn.execute("ROLLBACK")
-        raise
+    stale = conn.execute(
+        "SELECT id, attempts, max_attempts FROM jobs WHERE status='running' AND lease_until < ?",
+        (now,),
+    ).fetchall()
+    count = 0
+    for row in stale:
+        if row["attempts"] < row["max_attempts"]:
+            conn.execute(
+                "UPDATE jobs SET status='queued', holder=NULL, lease_until=NULL, updated_at=? WHERE id=?",
+                (now, row["id"]),
+            )
+            log_event(conn, row["id"], "requeued", "stale lease")
+        else:
+            conn.execute(
+                "UPDATE jobs SET status='failed', error='max attempts exceeded', updated_at=? WHERE id=?",
+                (now, row["id"]),
+            )
+            log_event(conn, row["id"], "failed", "max attempts exceeded")
+        count += 1
     return count
 
 
-def check_dedupe(dedupe_key):
-    """Return True if artifact with this hash already exists."""
-    if not dedupe_key:
-        return False
-    artifact_dir = Path(ARTIFACT_DIR)
-    if not artifact_dir.exists():
-        return False
-    for f in artifact_dir.iterdir():
-        if f.stem == dedupe_key:
-            return True
-    return False
+def reap_stale(db_path):
+    """Requeue expired leases, taking the write lock only when one exists."""
+    with db_conn(db_path) as conn:
+        if not conn.execute(
+            "SELECT 1 FROM jobs WHERE status='running' AND lease_until < ? LIMIT 1",
+            (time.time(),),
+        ).fetchone():
+            return 0
+    with with_writer(db_path) as conn:
+        return requeue_stale(conn)
+
+
+_artifact_mtimes = {}
+_artifact_lock = threading.Lock()
+
 
+def sync_artifacts(conn):
+    """Mirror ARTIFACT_DIR into the artifacts table when the directory changes.
 
-def claim_ready(conn, holder, lane=None, batch=1, lease_ms=LEASE_MS):
-    requeue_stale(conn)
+    Artifacts are written by other processes, so the table is rebuilt whenever
+    the directory's mtime moves (any add, remove, or rename).
+    """
+    try:
+        mtime = os.stat(ARTIFACT_DIR).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    with _artifact_lock:
+        if _artifact_mtimes.get(conn, -1) == mtime:
+            return
+        names = os.listdir(ARTIFACT_DIR) if mtime is not None else []
+        now = time.time()
+        conn.execute("DELETE FROM artifacts")
+        conn.executemany(
+            "INSERT OR IGNORE INTO artifacts(hash, path, created_at) VALUES(?, ?, ?)",
+            [(Path(name).stem, os.path.join(ARTIFACT_DIR, name), now) for name in names],
+        )
+        _artifact_mtimes[conn] = mtime
+
+
+def claim_ready(db_path, holder, lane=None, batch=1, lease_ms=LEASE_MS):
     now = time.time()
     lease_until = now + lease_ms / 1000.0
 
     lane_clause = ""
-    params = []
+    lane_params = []
     if lane is not None:
         lane_clause = "AND j.lane = ?"
-        params.append(lane)
+        lane_params.append(lane)
+
+    ready = f"""
+        SELECT j.id, j.dedupe_key, j.created_at
+        FROM jobs j
+        WHERE j.status = 'queued'
+          {lane_clause}
+          AND j.pending_deps = 0
+        ORDER BY j.created_at
+        LIMIT ?
+    """
+
+    # Polling workers stay off the write lock while nothing is ready.
+    with db_conn(db_path) as conn:
+        if not conn.execute(ready, [*lane_params, batch]).fetchone():
+            return []
 
-    conn.execute("BEGIN IMMEDIATE")
-    try:
-        query = f"""
-            SELECT j.id, j.lane, j.payload, j.dedupe_key
-            FROM jobs j
-            WHERE j.status = 'queued'
-              {lane_clause}
-              AND NOT EXISTS (
-                  SELECT 1 FROM job_deps d
-                  JOIN jobs dj ON dj.id = d.dep_id
-                  WHERE d.job_id = j.id AND dj.status != 'done'
-              )
-            ORDER BY j.created_at
-            LIMIT ?
-        """
-        params.append(batch)
-        rows = conn.execute(query, params).fetchall()
-
-        claimed = []
+    with with_writer(db_path) as conn:
+        sync_artifacts(conn)
+        # Dedupe pre-pass: retire ready jobs whose artifact already exists until
+        # the claim window holds none, so the claim below never hands them out.
+        while True:
+            retired = conn.execute(
+                f"""UPDATE jobs SET status='done', holder=?, updated_at=?
+                    WHERE status='queued' AND id IN (
+                        SELECT r.id FROM ({ready}) r JOIN artifacts a ON a.hash = r.dedupe_key
+                    )
+                    RETURNING id, dedupe_key""",
+                [holder, now, *lane_params, batch],
+            ).fetchall()
+            if not retired:
+                break
+            release_dependents(conn, [row["id"] for row in retired])
+            for row in retired:
+                log_event(conn, row["id"], "dedupe_skip", f"artifact exists for {row['dedupe_key']}")
+
+        rows = conn.execute(
+            f"""
+            WITH ready AS ({ready})
+            UPDATE jobs SET status='running', holder=?, lease_until=?, attempts=attempts+1, updated_at=?
+            WHERE id IN (SELECT id FROM ready)
+            RETURNING id, lane, payload, dedupe_key, created_at
+            """,
+            [*lane_params, batch, holder, lease_until, now],
+        ).fetchall()
+        rows.sort(key=lambda r: r["created_at"])
         for row in rows:
-            jid = row["id"]
-            dk = row["dedupe_key"]
-
-            # Dedupe: skip if artifact already exists
-            if check_dedupe(dk):
-                conn.execute(
-                    "UPDATE jobs SET status='done', holder=?, updated_at=? WHERE id=? AND status='queued'",
-                    (holder, now, jid),
-                )
-                log_event(conn, jid, "dedupe_skip", f"artifact exists for {dk}")
-                continue
+            log_event(conn, row["id"], "claimed", f"holder={holder}")
 
-            res = conn.execute(
-                """UPDATE jobs SET status='running', holder=?, lease_until=?, attempts=attempts+1, updated_at=?
-                   WHERE id=? AND status='queued'""",
-                (holder, lease_until, now, jid),
-            )
-            if res.rowcount:
-                log_event(conn, jid, "claimed", f"holder={holder}")
-                claimed.append(
-                    {
-                        "id": jid,
-                        "lane": row["lane"],
-                        "payload": row["payload"],
-                        "dedupe_key": dk,
-                    }
-                )
-        conn.execute("COMMIT")
-    except Exception:
-        conn.execute("ROLLBACK")
-        raise
-    return claimed
+    return [
+        {
+            "id": row["id"],
+            "lane": row["lane"],
+            "payload": row["payload"],
+            "dedupe_key": row["dedupe_key"],
+        }
+        for row in rows
+    ]
 
 
 def mark_done(conn, job_id, holder=None):
-    now = time.time()
-    if holder:
-        conn.execute(
-            "UPDATE jobs SET status='done', updated_at=? WHERE id=? AND status='running' AND holder=?",
-            (now, job_id, holder),
-        )
-    else:
-        conn.execute(
-            "UPDATE jobs SET status='done', updated_at=? WHERE id=? AND status='running'",
-            (now, job_id),
-        )
+    # A NULL holder matches any, so both call shapes share one prepared statement.
+    res = conn.execute(
+        """UPDATE jobs SET status='done', updated_at=:now
+           WHERE id=:id AND status='running' AND (:holder IS NULL OR holder=:holder)""",
+        {"now": time.time(), "id": job_id, "holder": holder or None},
+    )
+    if res.rowcount:
+        release_dependents(conn, [job_id])
     log_event(conn, job_id, "done", "")
-    conn.commit()
 
 
 def mark_failed(conn, job_id, error="", holder=None):
-    now = time.time()
-    if holder:
-        conn.execute(
-            "UPDATE jobs SET status='failed', error=?, updated_at=? WHERE id=? AND status='running' AND holder=?",
-            (error[:1000], now, job_id, holder),
-        )
-    else:
-        conn.execute(
-            "UPDATE jobs SET status='failed', error=?, updated_at=? WHERE id=? AND status='running'",
-            (error[:1000], now, job_id),
-        )
+    conn.execute(
+        """UPDATE jobs SET status='failed', error=:error, updated_at=:now
+           WHERE id=:id AND status='running' AND (:holder IS NULL OR holder=:holder)""",
+        {"error": error[:1000], "now": time.time(), "id": job_id, "holder": holder or None},
+    )
     log_event(conn, job_id, "failed", error[:200])
-    conn.commit()
 
 
 def heartbeat(conn, job_id, holder, lease_ms=LEASE_MS):
@@ -278,7 +514,6 @@ def heartbeat(conn, job_id, holder, lease_ms=LEASE_MS):
         "UPDATE jobs SET lease_until=?, updated_at=? WHERE id=? AND status='running' AND holder=?",
         (lease_until, now, job_id, holder),
     )
-    conn.commit()
     return res.rowcount > 0
 
 
@@ -308,13 +543,21 @@ def get_jobs(conn, status=None, limit=100):
 # ─── Plan Compiler ───────────────────────────────────────────────────────────
 
 
+_SLUG_RE = re.compile(r"[^a-zA-Z0-9_.-]")
+_SHA_RE = re.compile(r"#sha1=([a-fA-F0-9]+)")
+_STEP_RE = re.compile(r"^-\s*\[\s*\]\s+(.+)$")
+_FIELD_RE = re.compile(r"(\w+)=(\S+)")
+# Payloads may contain spaces; they run until a trailing dedupe=/deps= field.
+_PAYLOAD_RE = re.compile(r"payload=(.+?)(?:\s+(?:dedupe|deps)=.*)?$")
+
+
 def plan_slug(path):
     name = Path(path).stem
-    return re.sub(r"[^a-zA-Z0-9_.-]", "_", name)
+    return _SLUG_RE.sub("_", name)
 
 
 def extract_sha_from_payload(payload):
-    m = re.search(r"#sha1=([a-fA-F0-9]+)", payload)
+    m = _SHA_RE.search(payload)
     if m:
         return m.group(1)
     return None
@@ -323,293 +566,458 @@ def extract_sha_from_payload(payload):
 def parse_plan(plan_path):
     """Parse a markdown plan into jobs and deps."""
     text = Path(plan_path).read_text()
-    slug = plan_slug(plan_path)
 
-    # Extract policy
     policy = {}
+    plan_id = None
+    orphan_count = 0
+    steps = []
     for line in text.splitlines():
-        stripped = line.strip().lower()
-        if stripped.startswith("policy:"):
-            parts = stripped[len("policy:"):].split(",")
-            for p in parts:
+        if "TODO_ORPHAN:" in line:
+            orphan_count += 1
+        stripped = line.strip()
+        lowered = stripped.lower()
+
+        if lowered.startswith("policy:"):
+            for p in lowered[len("policy:"):].split(","):
                 p = p.strip()
                 if "=" in p:
                     k, v = p.split("=", 1)
                     policy[k.strip()] = v.strip()
+            continue
 
-    # Check plan_id header
-    plan_id = slug
-    for line in text.splitlines():
-        stripped = line.strip()
-        if stripped.lower().startswith("plan_id="):
+        if plan_id is None and lowered.startswith("plan_id="):
             plan_id = stripped.split("=", 1)[1].strip()
-            break
-
-    # ACCRUE_ALL_IDEAS enforcement
-    accrue = policy.get("accrue_all_ideas", "false").lower() == "true"
-    if accrue:
-        orphan_count = 0
-        for line in text.splitlines():
-            if "TODO_ORPHAN:" in line:
-                orphan_count += 1
-        if orphan_count > 0:
-            raise RuntimeError(
-                f"ACCRUE_ALL_IDEAS policy active but {orphan_count} TODO_ORPHAN markers found. "
-                "All ideas must be captured as steps before marking plan complete."
-            )
-
-    # Parse steps: lines matching - [ ] id=... lane=... payload=...
-    step_re = re.compile(
-        r"^-\s*\[\s*\]\s+(.+)$"
-    )
-    field_re = re.compile(r"(\w+)=(\S+)")
+            continue
 
-    steps = []
-    for line in text.splitlines():
-        m = step_re.match(line.strip())
+        # Steps: - [ ] id=... lane=... payload=...
+        m = _STEP_RE.match(stripped)
         if not m:
             continue
         rest = m.group(1)
-        fields = dict(field_re.findall(rest))
-        if "id" not in fields:
-            continue
-        if "lane" not in fields:
+        fields = dict(_FIELD_RE.findall(rest))
+        payload_m = _PAYLOAD_RE.search(rest)
+        if "id" not in fields or "lane" not in fields or not payload_m:
             continue
-        if "payload" not in fields:
-            # payload may contain spaces if quoted, but our regex won't capture that.
-            # Try extracting payload= to end of line after other fields
-            payload_m = re.search(r"payload=(.+?)(?:\s+(?:dedupe|deps)=|$)", rest)
-            if payload_m:
-                fields["payload"] = payload_m.group(1).strip()
-            else:
-                continue
 
-        step_id = fields["id"]
-        lane = int(fields["lane"])
-
-        # Reconstruct payload: everything after payload= minus trailing known fields
-        # Use a more robust extraction
-        payload_start = rest.find("payload=")
-        if payload_start >= 0:
-            payload_raw = rest[payload_start + len("payload="):]
-            # Strip trailing field assignments that come after
-            # But payload can contain spaces, so we look for next field= pattern
-            # that isn't part of the payload
-            cleaned = payload_raw
-            # Remove trailing deps=..., dedupe=... etc if they appear
-            for trailing_field in ["deps=", "dedupe="]:
-                idx = cleaned.rfind(trailing_field)
-                if idx > 0:
-                    cleaned = cleaned[:idx].rstrip()
-            fields["payload"] = cleaned
-        else:
-            # Fallback
-            fields["payload"] = fields.get("payload", "")
-
-        payload = fields["payload"]
+        payload = payload_m.group(1).strip()
         deps_str = fields.get("deps", "")
         deps = [d.strip() for d in deps_str.split(",") if d.strip()] if deps_str else []
-        dedupe_key = fields.get("dedupe", None) or extract_sha_from_payload(payload)
-
         steps.append(
             {
-                "id": step_id,
-                "global_id": f"{plan_id}::{step_id}",
-                "lane": lane,
+                "id": fields["id"],
+                "lane": int(fields["lane"]),
                 "payload": payload,
                 "deps": deps,
-                "dedupe_key": dedupe_key,
+                "dedupe_key": fields.get("dedupe", None) or extract_sha_from_payload(payload),
             }
         )
 
+    # ACCRUE_ALL_IDEAS enforcement
+    if policy.get("accrue_all_ideas", "false").lower() == "true" and orphan_count > 0:
+        raise RuntimeError(
+            f"ACCRUE_ALL_IDEAS policy active but {orphan_count} TODO_ORPHAN markers found. "
+            "All ideas must be captured as steps before marking plan complete."
+        )
+
+    # plan_id= may follow the steps, so global ids are assigned once it is known.
+    if plan_id is None:
+        plan_id = plan_slug(plan_path)
+    for step in steps:
+        step["global_id"] = f"{plan_id}::{step['id']}"
+
     return plan_id, steps, policy
 
 
-def expand_plan(db_path, plan_path):
-    """Compile plan into jobs in the DB. Returns (plan_id, step_count)."""
+def compile_plan(plan_path):
+    """Parse and validate a plan. Returns (plan_id, jobs) ready for enqueue_jobs."""
     plan_id, steps, policy = parse_plan(plan_path)
 
     if not steps:
         raise RuntimeError(f"No steps found in {plan_path}")
 
-    # Build step_id -> global_id map
     id_map = {s["id"]: s["global_id"] for s in steps}
-
-    with db_conn(db_path) as conn:
-        for step in steps:
-            enqueue_job(
-                conn,
-                step["global_id"],
-                step["lane"],
-                step["payload"],
-                dedupe_key=step["dedupe_key"],
-                max_attempts=MAX_ATTEMPTS,
-            )
-        conn.commit()
-
-        # Add deps
-        for step in steps:
-            for dep_id in step["deps"]:
-                if dep_id not in id_map:
-                    raise RuntimeError(
-                        f"Step '{step['id']}' depends on unknown step '{dep_id}'"
-                    )
-                add_dep(conn, step["global_id"], id_map[dep_id])
-        conn.commit()
-
-    return plan_id, len(steps)
-
-
-# ─── HTTP Server ─────────────────────────────────────────────────────────────
+    jobs = []
+    for step in steps:
+        validate_payload(step["payload"])
+        for dep_id in step["deps"]:
+            if dep_id not in id_map:
+                raise RuntimeError(
+                    f"Step '{step['id']}' depends on unknown step '{dep_id}'"
+                )
+        jobs.append(
+            {
+                "id": step["global_id"],
+                "lane": step["lane"],
+                "payload": step["payload"],
+                "dedupe_key": step["dedupe_key"],
+                "max_attempts": MAX_ATTEMPTS,
+                "deps": [id_map[d] for d in step["deps"]],
+            }
+        )
+    return plan_id, jobs
 
 
-class CodeHandler(http.server.BaseHTTPRequestHandler):
-    """HTTP handler for the scheduler API."""
+def enqueue_jobs(conn, jobs):
+    """Insert validated job dicts, their events and dep edges in one pass."""
+    now = time.time()
+    conn.executemany(
+        """INSERT OR IGNORE INTO jobs(id, lane, payload, status, created_at, updated_at, dedupe_key, max_attempts)
+           VALUES(?, ?, ?, 'queued', ?, ?, ?, ?)""",
+        [
+            (j["id"], j["lane"], j["payload"], now, now, j["dedupe_key"], j["max_attempts"])
+            for j in jobs
+        ],
+    )
+    log_events(conn, [(j["id"], "enqueued", j["payload"][:120]) for j in jobs])
+    add_deps(conn, [(j["id"], dep_id) for j in jobs for dep_id in j["deps"]])
+    # Jobs that already named these ids as deps start counting them now.
+    for chunk, marks in in_chunks([j["id"] for j in jobs]):
+        conn.execute(
+            f"""UPDATE jobs SET pending_deps = ({PENDING_DEPS_SQL})
+                WHERE id IN (SELECT job_id FROM job_deps WHERE dep_id IN ({marks}))""",
+            chunk,
+        )
 
-    db_path = DEFAULT_DB
 
-    def log_message(self, format, *args):
-        # Suppress default logging
-        pass
+def dep_order(jobs):
+    """Order jobs so each comes after the deps it names in the same list."""
+    by_id = {j["id"]: j for j in jobs}
+    ordered, seen, entered = [], set(), set()
+    for job in jobs:
+        stack = [(job, False)]
+        while stack:
+            j, expanded = stack.pop()
+            if expanded:
+                seen.add(j["id"])
+                ordered.append(j)
+                continue
+            # A job already entered is placed by its first visit (this also breaks cycles).
+            if j["id"] in entered:
+                continue
+            entered.add(j["id"])
+            stack.append((j, True))
+            for dep_id in reversed(j["deps"]):
+                if dep_id in by_id and dep_id not in entered:
+                    stack.append((by_id[dep_id], False))
+    return ordered
 
-    def _json_response(self, data, status=200):
-        body = json.dumps(data).encode()
-        self.send_response(status)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Content-Length", len(body))
-        self.end_headers()
-        self.wfile.write(body)
 
-    def _read_body(self):
-        length = int(self.headers.get("Content-Length", 0))
-        if length:
-            return json.loads(self.rfile.read(length))
-        return {}
+def expand_plan(db_path, plan_path):
+    """Compile plan into jobs in the DB. Returns (plan_id, step_count)."""
+    plan_id, jobs = compile_plan(plan_path)
+    with with_writer(db_path) as conn:
+        enqueue_jobs(conn, jobs)
+    return plan_id, len(jobs)
 
-    def _error(self, status, msg):
-        self._json_response({"error": msg}, status)
 
-    def do_GET(self):
-        parsed = urllib.parse.urlparse(self.path)
-        qs = urllib.parse.parse_qs(parsed.query)
+# ─── HTTP Server ─────────────────────────────────────────────────────────────
 
-        if parsed.path == "/stats":
-            with db_conn(self.db_path) as conn:
-                self._json_response(get_stats(conn))
 
-        elif parsed.path == "/jobs":
-            status = qs.get("status", [None])[0]
-            limit = int(qs.get("limit", [100])[0])
-            with db_conn(self.db_path) as conn:
-                self._json_response({"jobs": get_jobs(conn, status=status, limit=limit)})
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+
+class CodeServer:
+    """asyncio HTTP/1.1 server for the scheduler API.
+
+    The event loop only parses requests and writes responses, so idle and
+    keep-alive connections cost no threads; SQLite work runs on a bounded
+    pool whose threads keep their cached reader connections.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.pool = ThreadPoolExecutor(max_workers=HTTP_THREADS, thread_name_prefix="code-db")
+        # Replaced on every notify, so a waiter holding the old one is woken once.
+        self.work_event = asyncio.Event()
+        self.conns = set()
+        self.routes = {
+            ("GET", "/stats"): self.stats,
+            ("GET", "/jobs"): self.jobs,
+            ("GET", "/health"): self.health,
+            ("POST", "/ready"): self.ready,
+            ("POST", "/enqueue"): self.enqueue,
+            ("POST", "/enqueue_batch"): self.enqueue_batch,
+            ("POST", "/done"): self.done,
+            ("POST", "/done_batch"): self.done_batch,
+            ("POST", "/fail"): self.fail,
+            ("POST", "/fail_batch"): self.fail_batch,
+            ("POST", "/heartbeat"): self.heartbeat,
+            ("POST", "/update_batch"): self.update_batch,
+            ("POST", "/expand"): self.expand,
+        }
+
+    async def run_db(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, functools.partial(fn, *args, **kwargs))
+
+    def notify_work(self):
+        """Wake long-polling /ready requests after jobs may have become ready."""
+        self.work_event.set()
+        self.work_event = asyncio.Event()
+
+    async def janitor(self):
+        """Requeue stale leases every JANITOR_INTERVAL_S, off the claim path."""
+        while True:
+            await asyncio.sleep(JANITOR_INTERVAL_S)
+            try:
+                if await self.run_db(reap_stale, self.db_path):
+                    self.notify_work()
+            except sqlite3.Error as e:
+                sys.stderr.write(f"[code] janitor error: {e}\n")
 
-        elif parsed.path == "/health":
-            self._json_response({"status": "ok", "version": VERSION})
+    # ── connection handling ──
 
-        else:
-            self._error(404, "not found")
+    async def handle_conn(self, reader, writer):
+        task = asyncio.current_task()
+        self.conns.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                raw = await reader.readexactly(length) if length else b""
+
+                status, data = await self.dispatch(method, target, raw)
+
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+                body = json_dumps(data)
+                head = (
+                    f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                )
+                writer.write(head.encode("latin-1") + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Idle keep-alive and long-polling connections are cancelled at shutdown.
+            pass
+        finally:
+            self.conns.discard(task)
+            writer.close()
+
+    async def close_conns(self):
+        tasks = list(self.conns)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def dispatch(self, method, target, raw):
+        parsed = urllib.parse.urlparse(target)
+        handler = self.routes.get((method, parsed.path))
+        if handler is None:
+            return 404, {"error": "not found"}
+        try:
+            body = json_loads(raw) if raw else {}
+        except ValueError as e:
+            return 400, {"error": f"invalid JSON body: {e}"}
+        try:
+            return await handler(urllib.parse.parse_qs(parsed.query), body)
+        except Exception as e:
+            return 500, {"error": str(e)}
+
+    # ── routes ──
+
+    async def stats(self, qs, body):
+        return 200, await self.run_db(self._stats)
+
+    def _stats(self):
+        with db_conn(self.db_path) as conn:
+            return get_stats(conn)
+
+    async def jobs(self, qs, body):
+        status = qs.get("status", [None])[0]
+        limit = int(qs.get("limit", [100])[0])
+        return 200, {"jobs": await self.run_db(self._jobs, status, limit)}
+
+    def _jobs(self, status, limit):
+        with db_conn(self.db_path) as conn:
+            return get_jobs(conn, status=status, limit=limit)
+
+    async def health(self, qs, body):
+        return 200, {"status": "ok", "version": VERSION}
+
+    async def ready(self, qs, body):
+        holder = body.get("holder", "anon")
+        lane = body.get("lane")
+        batch = int(body.get("batch", 1))
+        if lane is not None:
+            lane = int(lane)
+        # ?wait=S holds the request open until a job is claimable or S elapse.
+        wait = min(float(qs.get("wait", [0])[0]), READY_WAIT_MAX_S)
+        deadline = time.monotonic() + wait
+        while True:
+            event = self.work_event
+            jobs = await self.run_db(claim_ready, self.db_path, holder, lane=lane, batch=batch)
+            remaining = deadline - time.monotonic()
+            if jobs or remaining <= 0:
+                return 200, {"jobs": jobs}
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
 
-    def do_POST(self):
-        parsed = urllib.parse.urlparse(self.path)
+    async def enqueue(self, qs, body):
+        try:
+            await self.run_db(self._enqueue, body)
+        except (KeyError, ValueError) as e:
+            return 400, {"error": str(e)}
+        self.notify_work()
+        return 200, {"ok": True, "id": body["id"]}
+
+    def _enqueue(self, body):
+        with with_writer(self.db_path) as conn:
+            enqueue_job(
+                conn,
+                body["id"],
+                int(body.get("lane", 0)),
+                body["payload"],
+                dedupe_key=body.get("dedupe_key"),
+                max_attempts=int(body.get("max_attempts", MAX_ATTEMPTS)),
+            )
+            add_deps(conn, [(body["id"], dep_id) for dep_id in body.get("deps", [])])
 
-        if parsed.path == "/ready":
-            body = self._read_body()
-            holder = body.get("holder", "anon")
-            lane = body.get("lane")
-            batch = int(body.get("batch", 1))
-            if lane is not None:
-                lane = int(lane)
-            with db_conn(self.db_path) as conn:
-                jobs = claim_ready(conn, holder, lane=lane, batch=batch)
-                self._json_response({"jobs": jobs})
+    async def enqueue_batch(self, qs, body):
+        try:
+            jobs = [
+                {
+                    "id": j["id"],
+                    "lane": int(j.get("lane", 0)),
+                    "payload": j["payload"],
+                    "dedupe_key": j.get("dedupe_key"),
+                    "max_attempts": int(j.get("max_attempts", MAX_ATTEMPTS)),
+                    "deps": list(j.get("deps", [])),
+                }
+                for j in body["jobs"]
+            ]
+            for j in jobs:
+                validate_payload(j["payload"])
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            return 400, {"error": str(e)}
+        if jobs:
+            await self.run_db(self._write, enqueue_jobs, jobs)
+            self.notify_work()
+        return 200, {"ok": True, "ids": [j["id"] for j in jobs]}
+
+    async def done(self, qs, body):
+        await self.run_db(self._write, mark_done, body["id"], holder=body.get("holder"))
+        self.notify_work()
+        return 200, {"ok": True}
+
+    async def done_batch(self, qs, body):
+        await self.run_db(self._write_each, mark_done, body["ids"], holder=body.get("holder"))
+        self.notify_work()
+        return 200, {"ok": True}
+
+    # No notify_work() for failures: mark_failed is terminal and a failed dep
+    # keeps its dependents blocked, so nothing becomes claimable.
+    async def fail(self, qs, body):
+        await self.run_db(
+            self._write, mark_failed, body["id"], error=body.get("error", ""), holder=body.get("holder")
+        )
+        return 200, {"ok": True}
 
-        elif parsed.path == "/enqueue":
-            body = self._read_body()
-            try:
-                with db_conn(self.db_path) as conn:
-                    enqueue_job(
-                        conn,
-                        body["id"],
-                        int(body.get("lane", 0)),
-                        body["payload"],
-                        dedupe_key=body.get("dedupe_key"),
-                        max_attempts=int(body.get("max_attempts", MAX_ATTEMPTS)),
-                    )
-                    deps = body.get("deps", [])
-                    for dep_id in deps:
-                        add_dep(conn, body["id"], dep_id)
-                    conn.commit()
-                self._json_response({"ok": True, "id": body["id"]})
-            except (KeyError, ValueError) as e:
-                self._error(400, str(e))
-
-        elif parsed.path == "/done":
-            body = self._read_body()
-            with db_conn(self.db_path) as conn:
-                mark_done(conn, body["id"], holder=body.get("holder"))
-            self._json_response({"ok": True})
-
-        elif parsed.path == "/fail":
-            body = self._read_body()
-            with db_conn(self.db_path) as conn:
-                mark_failed(
-                    conn, body["id"], error=body.get("error", ""), holder=body.get("holder")
-                )
-            self._json_response({"ok": True})
+    async def fail_batch(self, qs, body):
+        await self.run_db(
+            self._write_each, mark_failed, body["ids"], error=body.get("error", ""), holder=body.get("holder")
+        )
+        return 200, {"ok": True}
+
+    async def heartbeat(self, qs, body):
+        ok = await self.run_db(self._write, heartbeat, body["id"], body["holder"])
+        return 200, {"ok": ok}
+
+    async def update_batch(self, qs, body):
+        extended = await self.run_db(self._update_batch, body)
+        if body.get("done"):
+            self.notify_work()
+        return 200, {"ok": True, "extended": extended}
+
+    def _update_batch(self, body):
+        """Apply a worker's buffered done/failed/heartbeat updates in one transaction."""
+        holder = body.get("holder")
+        with with_writer(self.db_path) as conn:
+            for job_id in body.get("done", []):
+                mark_done(conn, job_id, holder=holder)
+            for item in body.get("failed", []):
+                mark_failed(conn, item["id"], error=item.get("error", ""), holder=holder)
+            return [job_id for job_id in body.get("heartbeat", []) if heartbeat(conn, job_id, holder)]
+
+    def _write(self, fn, *args, **kwargs):
+        with with_writer(self.db_path) as conn:
+            return fn(conn, *args, **kwargs)
+
+    def _write_each(self, fn, ids, **kwargs):
+        with with_writer(self.db_path) as conn:
+            for job_id in ids:
+                fn(conn, job_id, **kwargs)
+
+    async def expand(self, qs, body):
+        try:
+            plan_id, count = await self.run_db(expand_plan, self.db_path, body["plan"])
+        except Exception as e:
+            return 400, {"error": str(e)}
+        self.notify_work()
+        return 200, {"ok": True, "plan_id": plan_id, "steps": count}
 
-        elif parsed.path == "/heartbeat":
-            body = self._read_body()
-            with db_conn(self.db_path) as conn:
-                ok = heartbeat(conn, body["id"], body["holder"])
-            self._json_response({"ok": ok})
 
-        elif parsed.path == "/expand":
-            body = self._read_body()
-            try:
-                plan_id, count = expand_plan(self.db_path, body["plan"])
-                self._json_response({"ok": True, "plan_id": plan_id, "steps": count})
-            except Exception as e:
-                self._error(400, str(e))
+async def serve(db_path, host, port):
+    app = CodeServer(db_path)
+    server = await asyncio.start_server(app.handle_conn, host, port, reuse_address=True)
+    stop = asyncio.Event()
 
-        else:
-            self._error(404, "not found")
+    def _shutdown(signum):
+        sys.stderr.write(f"\n[code] received {signal.Signals(signum).name}, shutting down...\n")
+        stop.set()
 
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, _shutdown, signum)
 
-class ThreadedHTTPServer(http.server.ThreadingHTTPServer):
-    allow_reuse_address = True
-    daemon_threads = True
+    print(f"[code] server listening on http://{host}:{port}  db={db_path}")
+    janitor = asyncio.create_task(app.janitor())
+    async with server:
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            # Since 3.12 wait_closed() also waits for every client connection, so
+            # keep-alive and long-polling clients would otherwise hold shutdown open.
+            await app.close_conns()
+    janitor.cancel()
+    app.pool.shutdown(wait=True)
 
 
 def run_server(db_path, host, port):
     init_db(db_path)
-    CodeHandler.db_path = db_path
-    server = ThreadedHTTPServer((host, port), CodeHandler)
-
-    def _shutdown(signum, _frame):
-        signame = signal.Signals(signum).name
-        # Set the internal shutdown flag directly to avoid deadlock.
-        # server.shutdown() calls __is_shut_down.wait() which deadlocks
-        # when called from a signal handler in the same thread as serve_forever().
-        server._BaseServer__shutdown_request = True
-        sys.stderr.write(f"\n[code] received {signame}, shutting down...\n")
-
-    signal.signal(signal.SIGTERM, _shutdown)
-
-    print(f"[code] server listening on http://{host}:{port}  db={db_path}")
+    events = start_event_writer(db_path)
     try:
-        server.serve_forever()
+        asyncio.run(serve(db_path, host, port))
     except KeyboardInterrupt:
         pass
-    server.server_close()
+    finally:
+        stop_event_writer(events)
     print("[code] server stopped")
 
 
 def is_server_running(host, port):
     try:
-        url = f"http://{host}:{port}/health"
-        req = urllib.request.Request(url, method="GET")
-        with urllib.request.urlopen(req, timeout=2) as resp:
-            return resp.status == 200
+        api_get(host, port, "/health", timeout=2)
+        return True
     except Exception:
         return False
 
@@ -619,50 +1027,79 @@ def ensure_server(db_path, host, port):
     if is_server_running(host, port):
         return False
     init_db(db_path)
-    pid = os.fork()
-    if pid == 0:
-        # Child: become the server
-        os.setsid()
-        # Redirect stdout/stderr to log
-        log_dir = os.path.dirname(db_path)
-        log_path = os.path.join(log_dir, "server.log")
-        fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
-        os.dup2(fd, 1)
-        os.dup2(fd, 2)
-        os.close(fd)
-        # Close stdin
-        devnull = os.open(os.devnull, os.O_RDONLY)
-        os.dup2(devnull, 0)
-        os.close(devnull)
-        run_server(db_path, host, port)
-        os._exit(0)
-    else:
-        # Parent: wait for server to be ready
-        for _ in range(40):
-            time.sleep(0.15)
-            if is_server_running(host, port):
-                print(f"[code] server started (pid={pid}) on http://{host}:{port}")
-                return True
-        print(f"[code] WARNING: server may not have started (pid={pid})")
-        return True
+    log_path = os.path.join(os.path.dirname(db_path), "server.log")
+    with open(log_path, "ab") as log:
+        proc = subprocess.Popen(
+            [
+                sys.executable, os.path.abspath(__file__), "server",
+                "--db", db_path, "--host", host, "--port", str(port),
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=log,
+            start_new_session=True,
+            close_fds=True,
+        )
+    # Wait for server to be ready
+    for _ in range(40):
+        time.sleep(0.15)
+        if is_server_running(host, port):
+            print(f"[code] server started (pid={proc.pid}) on http://{host}:{port}")
+            return True
+    print(f"[code] WARNING: server may not have started (pid={proc.pid})")
+    return True
 
 
 # ─── HTTP Client helpers ─────────────────────────────────────────────────────
 
 
-def api_get(host, port, path):
-    url = f"http://{host}:{port}{path}"
-    with urllib.request.urlopen(url, timeout=10) as resp:
-        return json.loads(resp.read())
+_http_tls = threading.local()
+# Errors meaning a pooled connection was closed before any response came back.
+_RETRYABLE_ERRORS = (http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+
+def _http_request(host, port, method, path, body=None, timeout=HTTP_TIMEOUT_S):
+    """Send one request over this thread's keep-alive connection to host:port."""
+    conns = getattr(_http_tls, "conns", None)
+    if conns is None:
+        conns = _http_tls.conns = {}
+    headers = {"Connection": "keep-alive"}
+    if body is not None:
+        headers["Content-Type"] = "application/json"
+    for attempt in range(2):
+        conn = conns.get((host, port))
+        reused = conn is not None
+        if conn is None:
+            conn = conns[(host, port)] = http.client.HTTPConnection(host, port)
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        try:
+            conn.request(method, path, body, headers)
+            resp = conn.getresponse()
+            data = resp.read()
+        except (http.client.HTTPException, OSError) as e:
+            conn.close()
+            del conns[(host, port)]
+            # A pooled connection the server dropped before answering; retry once
+            # fresh. Anything else (e.g. a timeout) may have been processed, and
+            # POSTs such as /ready are not safe to send twice.
+            if reused and attempt == 0 and isinstance(e, _RETRYABLE_ERRORS):
+                continue
+            raise
+        if resp.status >= 400:
+            raise urllib.error.HTTPError(
+                f"http://{host}:{port}{path}", resp.status, resp.reason, resp.headers, io.BytesIO(data)
+            )
+        return json_loads(data)
+
 
+def api_get(host, port, path, timeout=HTTP_TIMEOUT_S):
+    return _http_request(host, port, "GET", path, timeout=timeout)
 
-def api_post(host, port, path, data):
-    url = f"http://{host}:{port}{path}"
-    body = json.dumps(data).encode()
-    req = urllib.request.Request(url, data=body, method="POST")
-    req.add_header("Content-Type", "application/json")
-    with urllib.request.urlopen(req, timeout=10) as resp:
-        return json.loads(resp.read())
+
+def api_post(host, port, path, data, timeout=HTTP_TIMEOUT_S):
+    return _http_request(host, port, "POST", path, json_dumps(data), timeout=timeout)
 
 
 # ─── Worker ──────────────────────────────────────────────────────────────────
@@ -694,27 +1131,33 @@ CMD_BLOCKLIST = [
 ]
 
 
+# Blocked patterns that are dangerous regardless of position; the rest only
+# block when the command's executable matches the pattern's.
+CMD_BLOCK_ANYWHERE = (":(){ ", "> /dev/", "mkfs", "dd if=")
+
+# Matchers compiled once from the lists above so each check is a single scan.
+_BLOCK_ANYWHERE_RE = re.compile("|".join(re.escape(b) for b in CMD_BLOCK_ANYWHERE))
+_BLOCK_BY_EXE = {}
+for _blocked in CMD_BLOCKLIST:
+    if _blocked not in CMD_BLOCK_ANYWHERE:
+        _BLOCK_BY_EXE.setdefault(_blocked.split()[0], []).append(re.escape(_blocked))
+_BLOCK_BY_EXE = {exe: re.compile("|".join(pats)) for exe, pats in _BLOCK_BY_EXE.items()}
+# Repo-local scripts (./...) are always allowed.
+_ALLOW_RE = re.compile("|".join(re.escape(p) for p in [*CMD_ALLOWLIST, "./"]))
+_ALLOW_EXACT = frozenset(p.strip() for p in CMD_ALLOWLIST)
+
+
 def is_cmd_safe(cmd):
     cmd_stripped = cmd.strip()
-    # Extract the executable (first token before space) for blocklist check
-    exe = cmd_stripped.split()[0] if cmd_stripped.split() else ""
-    # Blocklist: check the executable itself and specific dangerous full patterns
-    for blocked in CMD_BLOCKLIST:
-        blocked_exe = blocked.strip().split()[0]
-        if exe == blocked_exe and blocked in cmd_stripped:
-            return False
-        # Also block patterns that are dangerous regardless of position
-        if blocked in (":(){ ", "> /dev/", "mkfs", "dd if="):
-            if blocked in cmd_stripped:
-                return False
+    if _BLOCK_ANYWHERE_RE.search(cmd_stripped):
+        return False
+    # Blocklist: check the executable itself against its dangerous patterns
+    exe = cmd_stripped.split(maxsplit=1)[0] if cmd_stripped else ""
+    blocked = _BLOCK_BY_EXE.get(exe)
+    if blocked and blocked.search(cmd_stripped):
+        return False
     # Allowlist: command must start with an allowed prefix
-    for prefix in CMD_ALLOWLIST:
-        if cmd_stripped.startswith(prefix) or cmd_stripped == prefix.strip():
-            return True
-    # Allow any command that starts with ./ (repo-local scripts)
-    if cmd_stripped.startswith("./"):
-        return True
-    return False
+    return bool(_ALLOW_RE.match(cmd_stripped)) or cmd_stripped in _ALLOW_EXACT
 
 
 def execute_cmd(cmd):
@@ -742,126 +1185,143 @@ def apply_patch(path):
     return execute_cmd(f"patch -p1 < {path}")
 
 
-def worker_loop(host, port, holder, lane=None, batch=1, poll_interval=2.0, mode="local"):
+def worker_loop(host, port, holder, lane=None, batch=1, poll_interval=2.0, mode="local", log=print):
     """Poll for ready jobs and execute them."""
-    print(f"[code worker] holder={holder} lane={lane} mode={mode} poll={poll_interval}s")
+    log(f"[code worker] holder={holder} lane={lane} mode={mode} poll={poll_interval}s")
+    # Claimed jobs have no pending deps, so a batch can run side by side.
+    pool = ThreadPoolExecutor(max_workers=max(1, batch), thread_name_prefix=f"code-{holder}")
+    failures = 0
+    # Results the server has not accepted yet; they survive a failed round trip.
+    done, failed = [], []
+
+    def report(running=()):
+        # One round trip and one transaction for whatever finished, plus lease
+        # extensions for the claimed jobs still in flight.
+        api_post(
+            host, port, "/update_batch",
+            {"holder": holder, "done": list(done), "failed": list(failed), "heartbeat": list(running)},
+        )
+        done.clear()
+        failed.clear()
 
     while True:
         try:
+            if done or failed:
+                report()
             ready_body = {"holder": holder, "batch": batch}
             if lane is not None:
                 ready_body["lane"] = lane
-            result = api_post(host, port, "/ready", ready_body)
+            # Long-poll: the server answers as soon as a job is claimable.
+            result = api_post(
+                host, port, f"/ready?wait={READY_WAIT_MAX_S}", ready_body, timeout=READY_WAIT_MAX_S + 10
+            )
             jobs = result.get("jobs", [])
 
             for job in jobs:
-                jid = job["id"]
-                payload = job["payload"]
-                print(f"[code worker] claimed {jid}: {payload[:80]}")
-
-                if mode == "local":
-                    ok = execute_job_local(host, port, jid, payload, holder)
-                    if not ok:
-                        print(f"[code worker] job {jid} failed")
-                else:
-                    # LLM mode: just print the job for a human/LLM agent to handle
-                    print(f"[code worker] LLM job (manual): {jid} => {payload}")
-                    # Don't auto-complete; agent will mark done via API
-
-            if not jobs:
-                time.sleep(poll_interval)
+                log(f"[code worker] claimed {job['id']}: {job['payload'][:80]}")
+
+            if mode == "local":
+                running = {pool.submit(execute_job_local, job["payload"], log=log): job["id"] for job in jobs}
+                while running:
+                    finished, _ = wait_futures(running, timeout=HEARTBEAT_INTERVAL_S, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        jid = running.pop(future)
+                        error = future.result()
+                        if error is None:
+                            done.append(jid)
+                        else:
+                            failed.append({"id": jid, "error": error})
+                            log(f"[code worker] job {jid} failed")
+                    # Report results as they land, so a quick job is not held
+                    # past its lease behind a slow batch-mate.
+                    try:
+                        report(running.values())
+                    except Exception as e:
+                        if not running:
+                            raise
+                        log(f"[code worker] error: {e}")
             else:
-                time.sleep(0.05)
+                # LLM mode: just print the jobs for a human/LLM agent to handle
+                for job in jobs:
+                    log(f"[code worker] LLM job (manual): {job['id']} => {job['payload']}")
+                # Don't auto-complete; agent will mark done via API
+            failures = 0
 
         except KeyboardInterrupt:
-            print(f"\n[code worker] {holder} stopped")
+            log(f"\n[code worker] {holder} stopped")
             break
         except Exception as e:
-            print(f"[code worker] error: {e}")
-            time.sleep(poll_interval)
+            log(f"[code worker] error: {e}")
+            # Back off while the server is unreachable; a healthy one is long-polled instead.
+            failures += 1
+            time.sleep(min(poll_interval * 2 ** min(failures - 1, 4), READY_WAIT_MAX_S))
+    pool.shutdown(wait=False)
 
 
-def execute_job_local(host, port, jid, payload, holder):
-    """Execute a job locally. Returns True on success."""
+def execute_job_local(payload, log=print):
+    """Execute a job locally. Returns None on success, else the error message."""
     try:
         if payload.startswith("@cmd:"):
             cmd = payload[len("@cmd:"):]
             if not is_cmd_safe(cmd):
-                api_post(host, port, "/fail", {"id": jid, "holder": holder, "error": f"blocked command: {cmd[:60]}"})
-                return False
+                return f"blocked command: {cmd[:60]}"
             code, stdout, stderr = execute_cmd(cmd)
             if code == 0:
-                api_post(host, port, "/done", {"id": jid, "holder": holder})
                 if stdout.strip():
-                    print(f"  stdout: {stdout.strip()[:200]}")
-                return True
-            else:
-                err_msg = (stderr or stdout or f"exit code {code}")[:500]
-                api_post(host, port, "/fail", {"id": jid, "holder": holder, "error": err_msg})
-                print(f"  failed: {err_msg[:200]}")
-                return False
+                    log(f"  stdout: {stdout.strip()[:200]}")
+                return None
+            err_msg = (stderr or stdout or f"exit code {code}")[:500]
+            log(f"  failed: {err_msg[:200]}")
+            return err_msg
 
         elif payload.startswith("@file:") and "#apply" in payload:
             path = payload[len("@file:"):].split("#")[0]
             code, stdout, stderr = apply_patch(path)
             if code == 0:
-                api_post(host, port, "/done", {"id": jid, "holder": holder})
-                return True
-            else:
-                api_post(host, port, "/fail", {"id": jid, "holder": holder, "error": (stderr or stdout)[:500]})
-                return False
+                return None
+            return (stderr or stdout)[:500]
 
         elif payload.startswith("@file:") and "#test" in payload:
             path = payload[len("@file:"):].split("#")[0]
-            cmd = f"test -f {path}"
-            code, stdout, stderr = execute_cmd(cmd)
-            if code == 0:
-                api_post(host, port, "/done", {"id": jid, "holder": holder})
-                return True
-            else:
-                api_post(host, port, "/fail", {"id": jid, "holder": holder, "error": f"test failed: {path}"})
-                return False
+            # Same check as `test -f` from REPO_ROOT, without spawning a shell.
+            if os.path.isfile(os.path.join(REPO_ROOT, path)):
+                return None
+            return f"test failed: {path}"
 
         elif payload.startswith("@doc:") or payload.startswith("@url:") or payload.startswith("@git:") or payload.startswith("@gh:"):
             # Metadata-only: mark done immediately
-            api_post(host, port, "/done", {"id": jid, "holder": holder})
-            return True
+            return None
 
         elif payload.startswith("@file:"):
             # LLM-required job: in local mode, skip (leave running for LLM worker)
             # Actually in local mode we should not claim these. But if we did, fail gracefully.
-            api_post(host, port, "/fail", {"id": jid, "holder": holder, "error": "LLM-required job; not executable in local mode"})
-            return False
+            return "LLM-required job; not executable in local mode"
 
         else:
-            api_post(host, port, "/fail", {"id": jid, "holder": holder, "error": f"unknown payload type: {payload[:40]}"})
-            return False
+            return f"unknown payload type: {payload[:40]}"
 
     except Exception as e:
-        try:
-            api_post(host, port, "/fail", {"id": jid, "holder": holder, "error": str(e)[:500]})
-        except Exception:
-            pass
-        return False
+        return str(e)[:500]
 
 
 # ─── Hash helper ─────────────────────────────────────────────────────────────
 
 
 def compute_sha1(path):
-    h = hashlib.sha1()
     with open(path, "rb") as f:
-        while True:
-            chunk = f.read(8192)
-            if not chunk:
-                break
-            h.update(chunk)
-    return h.hexdigest()
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+: hashing loop runs in C
+            return hashlib.file_digest(f, "sha1").hexdigest()
+        if os.fstat(f.fileno()).st_size == 0:  # mmap rejects empty files
+            return hashlib.sha1(b"").hexdigest()
+        # One contiguous buffer, so OpenSSL hashes it in a single call.
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.sha1(mm).hexdigest()
 
 
 # ─── Contract Blocks ─────────────────────────────────────────────────────────
 
 
+@functools.lru_cache(maxsize=32)
 def worker_contract(host, port, holder="pane-N"):
     return f"""
 ╔══════════════════════════════════════════════════════════════╗
@@ -870,9 +1330,9 @@ def worker_contract(host, port, holder="pane-N"):
 ║                                                              ║
 ║  You are a code worker. Your loop:                           ║
 ║                                                              ║
-║  1. POST http://{host}:{port}/ready                          ║
+║  1. POST http://{host}:{port}/ready?wait=30                  ║
 ║     body: {{"holder":"{holder}","batch":1}}                  ║
-║     → receive jobs array                                     ║
+║     → receive jobs array (held open until one is ready)      ║
 ║  2. For each job:                                            ║
 ║     a. Read payload pointer (e.g. @file:path/to/spec)        ║
 ║     b. Do the work described by the pointer                  ║
@@ -897,6 +1357,7 @@ def worker_contract(host, port, holder="pane-N"):
 """
 
 
+@functools.lru_cache(maxsize=32)
 def executor_contract(host, port):
     return f"""
 ╔══════════════════════════════════════════════════════════════╗
@@ -928,16 +1389,13 @@ def cmd_server(args):
 
 
 def cmd_worker(args):
-    lane = args.lane
-    if lane is not None:
-        lane = int(lane)
     worker_loop(
         args.host,
         args.port,
         holder=args.holder,
-        lane=lane,
-        batch=int(args.batch),
-        poll_interval=float(args.poll),
+        lane=args.lane,
+        batch=args.batch,
+        poll_interval=args.poll,
         mode=args.mode,
     )
 
@@ -947,26 +1405,37 @@ def cmd_enqueue(args):
     validate_payload(payload)
     data = {
         "id": args.id or f"manual-{int(time.time()*1000)}",
-        "lane": int(args.lane),
+        "lane": args.lane,
         "payload": payload,
         "deps": [d.strip() for d in args.deps.split(",") if d.strip()] if args.deps else [],
     }
     if args.dedupe:
         data["dedupe_key"] = args.dedupe
-    result = api_post(args.host, args.port, "/enqueue", data)
+    result = api_post(args.host, args.port, "/enqueue_batch", {"jobs": [data]})
     print(json.dumps(result, indent=2))
 
 
 def cmd_done(args):
-    result = api_post(args.host, args.port, "/done", {"id": args.id, "holder": args.holder})
+    ids = args.id.split(",")
+    if len(ids) > 1:
+        result = api_post(args.host, args.port, "/done_batch", {"ids": ids, "holder": args.holder})
+    else:
+        result = api_post(args.host, args.port, "/done", {"id": args.id, "holder": args.holder})
     print(json.dumps(result, indent=2))
 
 
 def cmd_fail(args):
-    result = api_post(
-        args.host, args.port, "/fail",
-        {"id": args.id, "holder": args.holder, "error": args.error or ""},
-    )
+    ids = args.id.split(",")
+    if len(ids) > 1:
+        result = api_post(
+            args.host, args.port, "/fail_batch",
+            {"ids": ids, "holder": args.holder, "error": args.error or ""},
+        )
+    else:
+        result = api_post(
+            args.host, args.port, "/fail",
+            {"id": args.id, "holder": args.holder, "error": args.error or ""},
+        )
     print(json.dumps(result, indent=2))
 
 
@@ -979,7 +1448,13 @@ def cmd_heartbeat(args):
 
 
 def cmd_expand(args):
-    plan_id, count = expand_plan(args.db, args.plan)
+    if is_server_running(args.host, args.port):
+        # Through the server, so long-polling workers wake for the new jobs.
+        result = api_post(args.host, args.port, "/expand", {"plan": os.path.abspath(args.plan)})
+        plan_id, count = result["plan_id"], result["steps"]
+    else:
+        init_db(args.db)
+        plan_id, count = expand_plan(args.db, args.plan)
     print(f"[code] expanded plan '{plan_id}' → {count} jobs")
 
 
@@ -1023,15 +1498,19 @@ def cmd_run(args):
     # 2. Expand plan
     plan_path = args.plan
     print(f"[code] expanding plan: {plan_path}")
-    plan_id, count = expand_plan(db, plan_path)
-    print(f"[code] plan '{plan_id}' → {count} jobs enqueued")
+    plan_id, jobs = compile_plan(plan_path)
+    # Deps go out before their dependents so no chunk makes a job claimable early.
+    jobs = dep_order(jobs)
+    for i in range(0, len(jobs), ENQUEUE_CHUNK):
+        api_post(host, port, "/enqueue_batch", {"jobs": jobs[i:i + ENQUEUE_CHUNK]})
+    print(f"[code] plan '{plan_id}' → {len(jobs)} jobs enqueued")
 
     # 3. Show stats
     stats = api_get(host, port, "/stats")
     print(f"[code] stats: {json.dumps(stats)}")
 
     # 4. Print join commands
-    agents = int(args.agents)
+    agents = args.agents
     print()
     if agents > 0:
         print(f"[code] join commands for {agents} agent pane(s):")
@@ -1045,10 +1524,11 @@ def cmd_run(args):
     print(worker_contract(host, port, holder="pane-N"))
     print(executor_contract(host, port))
 
-    # 6. Optionally spawn local workers
+    # 6. Optionally run local workers, as threads of this process
     if getattr(args, "spawn_local", False) and agents > 0:
-        print(f"[code] spawning {agents} local workers ...")
-        pids = []
+        print(f"[code] starting {agents} local workers ...")
+        log_dir = os.path.dirname(db) or "."
+        threads = []
         for i in range(1, agents + 1):
             if i == 1:
                 lane = 1
@@ -1056,21 +1536,123 @@ def cmd_run(args):
                 lane = 3
             else:
                 lane = 2
-            pid = os.fork()
-            if pid == 0:
-                # Redirect output
-                log_dir = os.path.dirname(db) or "."
-                log_path = os.path.join(log_dir, f"worker-{i}.log")
-                fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
-                os.dup2(fd, 1)
-                os.dup2(fd, 2)
-                os.close(fd)
-                worker_loop(host, port, f"local-{i}", lane=lane, batch=1, poll_interval=0.2, mode="local")
-                os._exit(0)
-            else:
-                pids.append(pid)
-                print(f"  spawned worker local-{i} (pid={pid}) lane={lane}")
-        print(f"[code] {len(pids)} local workers running")
+            log_file = open(os.path.join(log_dir, f"worker-{i}.log"), "a")
+            thread = threading.Thread(
+                target=worker_loop,
+                args=(host, port, f"local-{i}"),
+                kwargs={
+                    "lane": lane,
+                    "batch": 1,
+                    "poll_interval": 0.2,
+                    "mode": "local",
+                    "log": functools.partial(print, file=log_file, flush=True),
+                },
+                name=f"local-{i}",
+                daemon=True,
+            )
+            thread.start()
+            threads.append(thread)
+            print(f"  started worker local-{i} lane={lane}")
+        print(f"[code] {len(threads)} local workers running; Ctrl-C to stop")
+        try:
+            while any(t.is_alive() for t in threads):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("\n[code] local workers stopped")
+
+
+def _host_port(p):
+    p.add_argument("--host", default=DEFAULT_HOST)
+    p.add_argument("--port", type=int, default=DEFAULT_PORT)
+
+
+def _args_server(p):
+    p.add_argument("--db", default=DEFAULT_DB)
+    _host_port(p)
+
+
+def _args_worker(p):
+    _host_port(p)
+    p.add_argument("--holder", default=f"worker-{os.getpid()}")
+    p.add_argument("--lane", type=int, default=None)
+    p.add_argument("--batch", type=int, default=1)
+    p.add_argument("--poll", type=float, default=2.0)
+    p.add_argument("--mode", choices=["local", "llm"], default="local")
+
+
+def _args_enqueue(p):
+    p.add_argument("payload")
+    p.add_argument("--id", default=None)
+    p.add_argument("--lane", type=int, default=0)
+    p.add_argument("--deps", default="")
+    p.add_argument("--dedupe", default=None)
+    _host_port(p)
+
+
+def _args_done(p):
+    p.add_argument("id", help="job id, or comma-separated ids")
+    p.add_argument("--holder", default=None)
+    _host_port(p)
+
+
+def _args_fail(p):
+    p.add_argument("id", help="job id, or comma-separated ids")
+    p.add_argument("--holder", default=None)
+    p.add_argument("--error", default="")
+    _host_port(p)
+
+
+def _args_heartbeat(p):
+    p.add_argument("id")
+    p.add_argument("--holder", required=True)
+    _host_port(p)
+
+
+def _args_expand(p):
+    p.add_argument("plan")
+    p.add_argument("--db", default=DEFAULT_DB)
+    _host_port(p)
+
+
+def _args_jobs(p):
+    p.add_argument("--status", default=None)
+    p.add_argument("--limit", type=int, default=100)
+    _host_port(p)
+
+
+def _args_join(p):
+    p.add_argument("--holder", default="pane-N")
+    _host_port(p)
+
+
+def _args_hash(p):
+    p.add_argument("path")
+
+
+def _args_run(p):
+    p.add_argument("plan")
+    p.add_argument("-n", "--agents", type=int, default=0)
+    p.add_argument("--spawn-local", action="store_true", dest="spawn_local")
+    p.add_argument("--db", default=DEFAULT_DB)
+    _host_port(p)
+
+
+# command -> (help, argument builder, handler)
+COMMANDS = {
+    "server": ("Start HTTP scheduler server", _args_server, cmd_server),
+    "worker": ("Start a worker loop", _args_worker, cmd_worker),
+    "enqueue": ("Enqueue a job", _args_enqueue, cmd_enqueue),
+    "done": ("Mark a job done", _args_done, cmd_done),
+    "fail": ("Mark a job failed", _args_fail, cmd_fail),
+    "heartbeat": ("Heartbeat a running job", _args_heartbeat, cmd_heartbeat),
+    "expand": ("Compile a plan into jobs", _args_expand, cmd_expand),
+    "stats": ("Show job stats", _host_port, cmd_stats),
+    "jobs": ("List jobs", _args_jobs, cmd_jobs),
+    "join": ("Print Worker Contract block", _args_join, cmd_join),
+    "exec": ("Print Executor Contract block", _host_port, cmd_exec),
+    "hash": ("Compute SHA1 of a file", _args_hash, cmd_hash),
+    "run": ("Ensure server, expand plan, print join commands", _args_run, cmd_run),
+}
 
 
 def main():
@@ -1081,94 +1663,12 @@ def main():
     parser.add_argument("--version", action="version", version=f"code {VERSION}")
     sub = parser.add_subparsers(dest="command")
 
-    # server
-    p_server = sub.add_parser("server", help="Start HTTP scheduler server")
-    p_server.add_argument("--db", default=DEFAULT_DB)
-    p_server.add_argument("--host", default=DEFAULT_HOST)
-    p_server.add_argument("--port", type=int, default=DEFAULT_PORT)
-
-    # worker
-    p_worker = sub.add_parser("worker", help="Start a worker loop")
-    p_worker.add_argument("--host", default=DEFAULT_HOST)
-    p_worker.add_argument("--port", type=int, default=DEFAULT_PORT)
-    p_worker.add_argument("--holder", default=f"worker-{os.getpid()}")
-    p_worker.add_argument("--lane", default=None)
-    p_worker.add_argument("--batch", default=1)
-    p_worker.add_argument("--poll", default="2")
-    p_worker.add_argument("--mode", choices=["local", "llm"], default="local")
-
-    # enqueue
-    p_enqueue = sub.add_parser("enqueue", help="Enqueue a job")
-    p_enqueue.add_argument("payload")
-    p_enqueue.add_argument("--id", default=None)
-    p_enqueue.add_argument("--lane", default="0")
-    p_enqueue.add_argument("--deps", default="")
-    p_enqueue.add_argument("--dedupe", default=None)
-    p_enqueue.add_argument("--host", default=DEFAULT_HOST)
-    p_enqueue.add_argument("--port", type=int, default=DEFAULT_PORT)
-
-    # done
-    p_done = sub.add_parser("done", help="Mark a job done")
-    p_done.add_argument("id")
-    p_done.add_argument("--holder", default=None)
-    p_done.add_argument("--host", default=DEFAULT_HOST)
-    p_done.add_argument("--port", type=int, default=DEFAULT_PORT)
-
-    # fail
-    p_fail = sub.add_parser("fail", help="Mark a job failed")
-    p_fail.add_argument("id")
-    p_fail.add_argument("--holder", default=None)
-    p_fail.add_argument("--error", default="")
-    p_fail.add_argument("--host", default=DEFAULT_HOST)
-    p_fail.add_argument("--port", type=int, default=DEFAULT_PORT)
-
-    # heartbeat
-    p_hb = sub.add_parser("heartbeat", help="Heartbeat a running job")
-    p_hb.add_argument("id")
-    p_hb.add_argument("--holder", required=True)
-    p_hb.add_argument("--host", default=DEFAULT_HOST)
-    p_hb.add_argument("--port", type=int, default=DEFAULT_PORT)
-
-    # expand
-    p_expand = sub.add_parser("expand", help="Compile a plan into jobs")
-    p_expand.add_argument("plan")
-    p_expand.add_argument("--db", default=DEFAULT_DB)
-
-    # stats
-    p_stats = sub.add_parser("stats", help="Show job stats")
-    p_stats.add_argument("--host", default=DEFAULT_HOST)
-    p_stats.add_argument("--port", type=int, default=DEFAULT_PORT)
-
-    # jobs
-    p_jobs = sub.add_parser("jobs", help="List jobs")
-    p_jobs.add_argument("--status", default=None)
-    p_jobs.add_argument("--limit", default="100")
-    p_jobs.add_argument("--host", default=DEFAULT_HOST)
-    p_jobs.add_argument("--port", type=int, default=DEFAULT_PORT)
-
-    # join
-    p_join = sub.add_parser("join", help="Print Worker Contract block")
-    p_join.add_argument("--holder", default="pane-N")
-    p_join.add_argument("--host", default=DEFAULT_HOST)
-    p_join.add_argument("--port", type=int, default=DEFAULT_PORT)
-
-    # exec
-    p_exec = sub.add_parser("exec", help="Print Executor Contract block")
-    p_exec.add_argument("--host", default=DEFAULT_HOST)
-    p_exec.add_argument("--port", type=int, default=DEFAULT_PORT)
-
-    # hash
-    p_hash = sub.add_parser("hash", help="Compute SHA1 of a file")
-    p_hash.add_argument("path")
-
-    # run
-    p_run = sub.add_parser("run", help="Ensure server, expand plan, print join commands")
-    p_run.add_argument("plan")
-    p_run.add_argument("-n", "--agents", default="0")
-    p_run.add_argument("--spawn-local", action="store_true", dest="spawn_local")
-    p_run.add_argument("--db", default=DEFAULT_DB)
-    p_run.add_argument("--host", default=DEFAULT_HOST)
-    p_run.add_argument("--port", type=int, default=DEFAULT_PORT)
+    # Only the invoked command's parser is built; top-level help and unknown
+    # commands get the full tree.
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    for name in [command] if command in COMMANDS else COMMANDS:
+        help_text, add_args, _ = COMMANDS[name]
+        add_args(sub.add_parser(name, help=help_text))
 
     args = parser.parse_args()
 
@@ -1176,28 +1676,7 @@ def main():
         parser.print_help()
         sys.exit(1)
 
-    dispatch = {
-        "server": cmd_server,
-        "worker": cmd_worker,
-        "enqueue": cmd_enqueue,
-        "done": cmd_done,
-        "fail": cmd_fail,
-        "heartbeat": cmd_heartbeat,
-        "expand": cmd_expand,
-        "stats": cmd_stats,
-        "jobs": cmd_jobs,
-        "join": cmd_join,
-        "exec": cmd_exec,
-        "hash": cmd_hash,
-        "run": cmd_run,
-    }
-
-    fn = dispatch.get(args.command)
-    if fn:
-        fn(args)
-    else:
-        parser.print_help()
-        sys.exit(1)
+    COMMANDS[args.command][2](args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,257 @@
+"""Tests for scripts/code.py.
+
+Run: python3 -m unittest discover -s scripts -p 'test_*.py'
+"""
+
+import contextlib
+import importlib.util
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+# code.py shadows the stdlib `code` module, so load it by path.
+_spec = importlib.util.spec_from_file_location(
+    "code_runtime", os.path.join(os.path.dirname(os.path.abspath(__file__)), "code.py")
+)
+code = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(code)
+
+
+class DBTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.db = os.path.join(self.tmp, "code.db")
+        code.init_db(self.db)
+
+    def enqueue(self, job_id, deps=(), dedupe_key=None):
+        with code.with_writer(self.db) as conn:
+            code.enqueue_job(conn, job_id, 1, f"@doc:{job_id}", dedupe_key=dedupe_key)
+            code.add_deps(conn, [(job_id, dep_id) for dep_id in deps])
+
+    def claim(self, batch=10):
+        return sorted(job["id"] for job in code.claim_ready(self.db, "h", batch=batch))
+
+    def job(self, job_id):
+        conn = sqlite3.connect(self.db)
+        conn.row_factory = sqlite3.Row
+        try:
+            return conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+
+
+class WithWriterTest(DBTestCase):
+    def test_done_and_failed_are_committed(self):
+        self.enqueue("a")
+        self.enqueue("b")
+        self.assertEqual(self.claim(), ["a", "b"])
+        with code.with_writer(self.db) as conn:
+            code.mark_done(conn, "a", holder="other")
+            code.mark_failed(conn, "b", error="boom", holder="h")
+        self.assertEqual(self.job("a")["status"], "running")
+        self.assertEqual((self.job("b")["status"], self.job("b")["error"]), ("failed", "boom"))
+        with code.with_writer(self.db) as conn:
+            code.mark_done(conn, "a", holder="h")
+        self.assertEqual(self.job("a")["status"], "done")
+
+    def test_error_rolls_back(self):
+        self.enqueue("a")
+        self.claim()
+        with self.assertRaises(RuntimeError):
+            with code.with_writer(self.db) as conn:
+                code.mark_done(conn, "a")
+                raise RuntimeError("abort")
+        self.assertEqual(self.job("a")["status"], "running")
+
+    def test_failed_commit_leaves_writer_usable(self):
+        real = sqlite3.connect(":memory:", isolation_level=None)
+
+        class FlakyCommit:
+            failed = False
+
+            @property
+            def in_transaction(self):
+                return real.in_transaction
+
+            def execute(self, sql, *args):
+                if sql == "COMMIT" and not self.failed:
+                    self.failed = True
+                    raise sqlite3.OperationalError("database is locked")
+                return real.execute(sql, *args)
+
+        with mock.patch.dict(code._writers, {"flaky": (FlakyCommit(), threading.Lock())}):
+            with self.assertRaises(sqlite3.OperationalError):
+                with code.with_writer("flaky") as conn:
+                    conn.execute("CREATE TABLE t(x)")
+            self.assertFalse(real.in_transaction)
+            with code.with_writer("flaky") as conn:
+                conn.execute("CREATE TABLE t(x)")
+
+
+class PendingDepsTest(DBTestCase):
+    def pending(self, job_id):
+        return self.job(job_id)["pending_deps"]
+
+    def test_done_dep_releases_dependent(self):
+        self.enqueue("a")
+        self.enqueue("b", deps=["a"])
+        self.assertEqual(self.pending("b"), 1)
+        self.assertEqual(self.claim(), ["a"])
+        with code.with_writer(self.db) as conn:
+            code.mark_done(conn, "a")
+        self.assertEqual(self.pending("b"), 0)
+        self.assertEqual(self.claim(), ["b"])
+
+    def test_dep_enqueued_later_starts_counting(self):
+        self.enqueue("b", deps=["a"])
+        self.assertEqual(self.pending("b"), 0)
+        self.enqueue("a")
+        self.assertEqual(self.pending("b"), 1)
+        self.assertEqual(self.claim(), ["a"])
+
+    def test_failed_dep_keeps_blocking(self):
+        self.enqueue("a")
+        self.enqueue("b", deps=["a"])
+        self.claim()
+        with code.with_writer(self.db) as conn:
+            code.mark_failed(conn, "a", error="boom")
+        self.assertEqual(self.pending("b"), 1)
+        self.assertEqual(self.claim(), [])
+
+    def test_migration_backfills_counts(self):
+        db = os.path.join(self.tmp, "old.db")
+        conn = sqlite3.connect(db)
+        conn.executescript(
+            """
+            CREATE TABLE jobs (
+                id TEXT PRIMARY KEY, lane INTEGER NOT NULL DEFAULT 0, payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued', holder TEXT, lease_until REAL,
+                created_at REAL NOT NULL, updated_at REAL NOT NULL, error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL DEFAULT 3,
+                dedupe_key TEXT
+            );
+            CREATE TABLE job_deps (job_id TEXT NOT NULL, dep_id TEXT NOT NULL, PRIMARY KEY (job_id, dep_id));
+            CREATE TABLE events (ts REAL NOT NULL, job_id TEXT, kind TEXT NOT NULL, msg TEXT);
+            INSERT INTO jobs(id, payload, status, created_at, updated_at) VALUES
+                ('a', '@doc:a', 'queued', 1, 1), ('b', '@doc:b', 'queued', 2, 2),
+                ('c', '@doc:c', 'done', 3, 3), ('d', '@doc:d', 'queued', 4, 4);
+            INSERT INTO job_deps VALUES ('b', 'a'), ('d', 'c'), ('d', 'missing');
+            """
+        )
+        conn.close()
+        code.init_db(db)
+        conn = sqlite3.connect(db)
+        try:
+            counts = dict(conn.execute("SELECT id, pending_deps FROM jobs"))
+        finally:
+            conn.close()
+        self.assertEqual(counts, {"a": 0, "b": 1, "c": 0, "d": 0})
+
+
+class DedupeTest(DBTestCase):
+    def test_claim_retires_jobs_with_an_artifact(self):
+        artifacts = os.path.join(self.tmp, "by-hash")
+        os.makedirs(artifacts)
+        with open(os.path.join(artifacts, "abc123.diff"), "w") as f:
+            f.write("x")
+        self.enqueue("hit", dedupe_key="abc123")
+        self.enqueue("miss", dedupe_key="def456")
+        self.enqueue("after", deps=["hit"])
+        with mock.patch.object(code, "ARTIFACT_DIR", artifacts):
+            self.assertEqual(self.claim(), ["after", "miss"])
+        self.assertEqual(self.job("hit")["status"], "done")
+
+    @unittest.skipUnless(hasattr(sqlite3.Connection, "setlimit"), "needs Connection.setlimit")
+    def test_large_id_lists_fit_old_variable_limit(self):
+        ids = [f"d{i}" for i in range(1200)]
+        with code.with_writer(self.db) as conn:
+            conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+            code.add_deps(conn, [("z", dep_id) for dep_id in ids])
+            code.release_dependents(conn, ids)
+
+
+class DepOrderTest(unittest.TestCase):
+    def ids(self, jobs):
+        return [job["id"] for job in code.dep_order(jobs)]
+
+    def test_deps_come_first(self):
+        jobs = [
+            {"id": "c", "deps": ["b"]},
+            {"id": "b", "deps": ["a", "outside"]},
+            {"id": "d", "deps": ["a", "c"]},
+            {"id": "a", "deps": []},
+        ]
+        order = self.ids(jobs)
+        self.assertEqual(sorted(order), ["a", "b", "c", "d"])
+        for job in jobs:
+            for dep_id in job["deps"]:
+                if dep_id in order:
+                    self.assertLess(order.index(dep_id), order.index(job["id"]))
+
+    def test_cycle_terminates(self):
+        jobs = [{"id": "a", "deps": ["b"]}, {"id": "b", "deps": ["a"]}, {"id": "c", "deps": ["a"]}]
+        self.assertEqual(sorted(self.ids(jobs)), ["a", "b", "c"])
+
+
+class WorkerLoopTest(unittest.TestCase):
+    def test_server_lost_mid_batch_keeps_results(self):
+        calls = []
+        server = {"up": False}
+
+        def fake_post(host, port, path, data, **kwargs):
+            calls.append((path.split("?")[0], data))
+            if path.startswith("/ready"):
+                if len(calls) > 1:
+                    raise KeyboardInterrupt
+                return {"jobs": [{"id": "a", "payload": "@doc:a"}, {"id": "b", "payload": "@doc:b"}]}
+            if not server["up"]:
+                raise ConnectionRefusedError(111, "Connection refused")
+            return {"ok": True, "extended": []}
+
+        logs = []
+        with mock.patch.object(code, "api_post", fake_post), mock.patch.object(code.time, "sleep") as sleep:
+            sleep.side_effect = lambda s: server.update(up=True)
+            code.worker_loop("127.0.0.1", 1, "w1", batch=2, poll_interval=0.5, log=logs.append)
+
+        sleep.assert_called_once_with(0.5)
+        self.assertTrue(any("Connection refused" in line for line in logs), logs)
+        # The results from before the outage are resent before the next claim.
+        self.assertEqual([path for path, _ in calls[-2:]], ["/update_batch", "/ready"])
+        self.assertEqual(sorted(calls[-2][1]["done"]), ["a", "b"])
+
+    def test_quick_result_is_not_held_behind_a_slow_job(self):
+        calls = []
+        reported = threading.Event()
+
+        def fake_post(host, port, path, data, **kwargs):
+            calls.append((path.split("?")[0], data))
+            if path.startswith("/ready"):
+                if len(calls) > 1:
+                    raise KeyboardInterrupt
+                return {"jobs": [{"id": "fast", "payload": "fast"}, {"id": "slow", "payload": "slow"}]}
+            if "fast" in data["done"]:
+                reported.set()
+            return {"ok": True, "extended": data["heartbeat"]}
+
+        def fake_execute(payload, **kwargs):
+            if payload == "slow" and not reported.wait(5):
+                return "fast result was held back"
+            return None
+
+        with mock.patch.object(code, "api_post", fake_post), mock.patch.object(code, "execute_job_local", fake_execute):
+            with contextlib.redirect_stdout(io.StringIO()):
+                code.worker_loop("127.0.0.1", 1, "w1", batch=2)
+
+        updates = [data for path, data in calls if path == "/update_batch"]
+        self.assertEqual((updates[0]["done"], updates[0]["heartbeat"]), (["fast"], ["slow"]))
+        self.assertEqual(updates[-1]["done"], ["slow"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,53 +4,82 @@ import json
 import os
 import sys
 import time
+from collections import defaultdict
 from datetime import datetime, timezone
+from urllib.error import HTTPError
 from urllib.request import Request, urlopen
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 DEFAULT_SOURCE_URL = "https://raw.githubusercontent.com/BerriAI/litellm/main/model_prices_and_context_window.json"
 
 
-def fetch_json(url):
+def fetch_json(url, etag=None):
+    """Return (data, etag), or None if the server reports etag is still current."""
     req = Request(url, headers={"User-Agent": "OllamaBotPricing/1.0"})
-    with urlopen(req, timeout=30) as resp:
+    if etag:
+        req.add_header("If-None-Match", etag)
+    try:
+        resp = urlopen(req, timeout=30)
+    except HTTPError as exc:
+        if exc.code == 304:
+            return None
+        raise
+    with resp:
         if resp.status != 200:
             raise RuntimeError(f"Failed to fetch {url} (status {resp.status})")
-        return json.loads(resp.read().decode("utf-8"))
+        return json.loads(resp.read().decode("utf-8")), resp.headers.get("ETag")
+
+
+def previous_etag(path, url):
+    try:
+        with open(path, encoding="utf-8") as f:
+            source = json.load(f)["sources"][0]
+    except (OSError, ValueError, KeyError, IndexError):
+        return None
+    return source.get("etag") if source.get("url") == url else None
 
 
 def normalize(value):
     return value.strip().lower()
 
 
+# Checked in order; a model matches a rule if it contains any needle or
+# starts with any prefix.
+_PROVIDER_RULES = (
+    ("anthropic", ("claude",), ()),
+    ("openai", ("gpt",), ("o1-",)),
+    ("gemini", ("gemini",), ()),
+    ("cohere", ("command-r", "cohere"), ()),
+    ("mistral", ("mistral",), ()),
+    ("groq", ("groq",), ()),
+    ("perplexity", ("perplexity",), ("pplx",)),
+    ("together", ("together",), ()),
+    ("fireworks", ("fireworks",), ()),
+)
+
+
 def split_provider(model_name):
     if "/" in model_name:
         provider, model = model_name.split("/", 1)
         return normalize(provider), normalize(model)
     lower = normalize(model_name)
-    if "claude" in lower:
-        return "anthropic", lower
-    if lower.startswith("gpt-") or lower.startswith("o1-") or "gpt" in lower:
-        return "openai", lower
-    if "gemini" in lower:
-        return "gemini", lower
-    if "command-r" in lower or "cohere" in lower:
-        return "cohere", lower
-    if "mistral" in lower:
-        return "mistral", lower
-    if "groq" in lower:
-        return "groq", lower
-    if "perplexity" in lower or lower.startswith("pplx"):
-        return "perplexity", lower
-    if "together" in lower:
-        return "together", lower
-    if "fireworks" in lower:
-        return "fireworks", lower
+    for provider, needles, prefixes in _PROVIDER_RULES:
+        if prefixes and lower.startswith(prefixes):
+            return provider, lower
+        for needle in needles:
+            if needle in lower:
+                return provider, lower
     return "unknown", lower
 
 
 def build_catalog(raw, source_name, source_url):
-    providers = {}
+    providers = defaultdict(dict)
+    _split = split_provider
     for model_name, info in raw.items():
         input_cost = info.get("input_cost_per_token")
         output_cost = info.get("output_cost_per_token")
@@ -61,15 +90,14 @@ def build_catalog(raw, source_name, source_url):
             output_cost = float(output_cost or 0.0)
         except (TypeError, ValueError):
             continue
-        provider, model = split_provider(model_name)
-        providers.setdefault(provider, {})
+        provider, model = _split(model_name)
         providers[provider][model] = {
             "inputPer1K": round(input_cost * 1000.0, 8),
             "outputPer1K": round(output_cost * 1000.0, 8),
             "currency": "USD",
             "source": source_name
         }
-    return providers
+    return dict(providers)
 
 
 def main():
@@ -86,7 +114,11 @@ def main():
         output_path = os.path.join(config_dir, "pricing.json")
 
     started = time.time()
-    raw = fetch_json(args.url)
+    fetched = fetch_json(args.url, previous_etag(output_path, args.url))
+    if fetched is None:
+        print(f"Pricing catalog unchanged: {output_path}")
+        return
+    raw, etag = fetched
     providers = build_catalog(raw, "litellm", args.url)
     timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
@@ -97,17 +129,25 @@ def main():
             {
                 "name": "litellm",
                 "url": args.url,
-                "fetchedAt": timestamp
+                "fetchedAt": timestamp,
+                "etag": etag
             }
         ],
         "providers": providers
     }
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        if args.pretty:
-            json.dump(payload, f, indent=2)
-        else:
-            json.dump(payload, f)
+    # Write beside the target and rename over it, so readers never see a partial file.
+    tmp_path = output_path + ".tmp"
+    if orjson is not None:
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(payload, option=orjson.OPT_INDENT_2 if args.pretty else 0))
+    else:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            if args.pretty:
+                json.dump(payload, f, indent=2)
+            else:
+                json.dump(payload, f, separators=(",", ":"))
+    os.replace(tmp_path, output_path)
 
     elapsed = time.time() - started
     print(f"Pricing catalog updated: {output_path}")